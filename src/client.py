@@ -1,35 +1,96 @@
 import email
 import imaplib
 import logging
+import re
+from datetime import datetime
 from email.message import Message
 from imaplib import IMAP4
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
-from .models import AuthException
+from .models import AuthException, ThrottledException
 
 from .utils.decorators import timed_operation
 from .utils.imap_search_criteria import IMAPSearchCriteria
 
+UID_PATTERN = re.compile(rb'UID (\d+)')
+GMAIL_MSGID_PATTERN = re.compile(rb'^(\d+) \(.*X-GM-MSGID (\d+)')
+INTERNALDATE_PATTERN = re.compile(rb'INTERNALDATE "([^"]+)"')
+THROTTLE_MARKERS = ('[THROTTLED]', 'Too many simultaneous connections')
+
+
+def is_throttled(response) -> bool:
+    text = response.decode('utf-8', errors='replace') if isinstance(
+        response, bytes) else str(response)
+    return any(marker in text for marker in THROTTLE_MARKERS)
+
+
+def normalize_id(email_id: bytes | str) -> str:
+    return email_id.decode() if isinstance(email_id, bytes) else email_id
+
+
+def message_set(ids: List[bytes | str]) -> str:
+    """Join ids into an IMAP message set, consecutive ids become ranges (1,2,3,5 -> 1:3,5)."""
+    ranges: List[List[int]] = []
+    for email_id in map(int, map(normalize_id, ids)):
+        if ranges and ranges[-1][1] + 1 == email_id:
+            ranges[-1][1] = email_id
+        else:
+            ranges.append([email_id, email_id])
+    return ','.join(str(start) if start == end else f'{start}:{end}' for start, end in ranges)
+
+
+def quote_mailbox(mailbox: str) -> str:
+    if mailbox.startswith('"') or not any(c in mailbox for c in ' "\\'):
+        return mailbox
+    escaped = mailbox.replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
 
 class EmailClient:
-    def __init__(self, email_user: str, email_pass: str, server: str, mailbox: str = "inbox"):
+    def __init__(
+        self,
+        email_user: str,
+        email_pass: str,
+        server: str,
+        mailbox: str = "inbox",
+        port: Optional[int] = None,
+        use_ssl: bool = True,
+    ):
         self.server = server
         self.email_user = email_user
         self.email_pass = email_pass
         self.mailbox = mailbox
-        self.connection: Optional[imaplib.IMAP4_SSL] = None
+        self.port = port
+        self.use_ssl = use_ssl
+        self.connection: Optional[imaplib.IMAP4] = None
+        self.uid_validity: Optional[int] = None
         self.logger = logging.getLogger(__name__)
 
+    @property
+    def supports_gmail_extensions(self) -> bool:
+        return self.connection is not None and 'X-GM-EXT-1' in self.connection.capabilities
+
     def connect(self):
         try:
-            self.connection = imaplib.IMAP4_SSL(self.server)
+            if self.use_ssl:
+                self.connection = imaplib.IMAP4_SSL(
+                    self.server, self.port or imaplib.IMAP4_SSL_PORT)
+            else:
+                self.connection = imaplib.IMAP4(
+                    self.server, self.port or imaplib.IMAP4_PORT)
             self.connection.login(self.email_user, self.email_pass)
-            status, msg = self.connection.select(self.mailbox)
+            status, msg = self.connection.select(quote_mailbox(self.mailbox))
             if status != 'OK':
                 raise ValueError(
                     '.'.join(text.decode('utf-8') for text in msg))
+            # UIDs are only comparable between sessions with the same UIDVALIDITY
+            _, validity = self.connection.response('UIDVALIDITY')
+            self.uid_validity = int(validity[0]) if validity and validity[0] else None
             self.logger.debug('Connected to the email server')
         except IMAP4.error as e:
+            if is_throttled(e):
+                raise ThrottledException(
+                    f'The email server is throttling connections: {e}') from e
             raise AuthException(
                 "Unable to connect to Email Client with those credentials.")
 
@@ -45,22 +106,135 @@ class EmailClient:
         return None
 
     @timed_operation
-    def fetch_emails_by_ids(self, email_ids: List[str]) -> Tuple[List[Message], float]:
-        emails: List[Message] = []
-        for email_id in email_ids:
-            try:
-                status, msg_data = self.connection.fetch(email_id, "(RFC822)")
-                if status != 'OK':
-                    self.logger.error(
-                        f'Failed to get email with ID {email_id}')
-                    continue
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-                        emails.append(msg)
-            except Exception as e:
-                self.logger.exception(
-                    f'Error fetching email with ID {email_id}: {e}')
+    def fetch_email_map(self, email_ids: List[str]) -> Tuple[Dict[str, Message], float]:
+        """
+        Fetch all the emails with a single FETCH command.
+
+        Returns:
+            Dict[str, Message]: Emails by id, ids that no longer exist are missing.
+
+        Raises:
+            ThrottledException: The server throttled the command or closed the connection.
+        """
+        emails: Dict[str, Message] = {}
+        for email_id, response_part in self._fetch(email_ids, "(RFC822)"):
+            if isinstance(response_part, tuple):
+                emails[email_id] = email.message_from_bytes(response_part[1])
+        return emails
+
+    @timed_operation
+    def fetch_gmail_message_ids(self, email_ids: List[str]) -> Tuple[Dict[str, str], float]:
+        """
+        Fetch the X-GM-MSGID of the emails, it identifies an email across every label.
+
+        Returns:
+            Dict[str, str]: X-GM-MSGID by email id.
+        """
+        message_ids: Dict[str, str] = {}
+        for _, response_part in self._fetch(email_ids, "(X-GM-MSGID)"):
+            header = response_part[0] if isinstance(
+                response_part, tuple) else response_part
+            match = GMAIL_MSGID_PATTERN.match(header or b'')
+            if match:
+                message_ids[match.group(1).decode()] = match.group(2).decode()
+        return message_ids
+
+    @timed_operation
+    def fetch_email_headers(self, email_ids: List[str]) -> Tuple[List[Tuple[Optional[datetime], Optional[str]]], float]:
+        """
+        Fetch only the INTERNALDATE and From header of the emails, bodies are not downloaded.
+
+        Returns:
+            List[Tuple[Optional[datetime], Optional[str]]]: (received date, From header) per email.
+        """
+        headers = []
+        for _, response_part in self._fetch(email_ids, "(INTERNALDATE BODY.PEEK[HEADER.FIELDS (FROM)])"):
+            if not isinstance(response_part, tuple):
+                continue
+            match = INTERNALDATE_PATTERN.search(response_part[0])
+            date = datetime.strptime(match.group(1).decode(
+            ), '%d-%b-%Y %H:%M:%S %z') if match else None
+            sender = email.message_from_bytes(response_part[1]).get('from')
+            headers.append((date, sender))
+        return headers
+
+    def _fetch(self, email_ids: List[str], items: str) -> List[Tuple[str, bytes | tuple]]:
+        if not email_ids:
+            return []
+        try:
+            status, msg_data = self.connection.fetch(
+                message_set(email_ids), items)
+        except (IMAP4.abort, OSError) as e:
+            raise ThrottledException(
+                f'Connection closed by the email server: {e}') from e
+        except IMAP4.error as e:
+            if is_throttled(e):
+                raise ThrottledException(
+                    f'The email server is throttling requests: {e}') from e
+            self.logger.error(
+                f'Failed to get emails with IDs {message_set(email_ids)}: {e}')
+            return []
+        if status != 'OK':
+            if any(is_throttled(part) for part in msg_data):
+                raise ThrottledException(
+                    f'The email server is throttling requests: {msg_data}')
+            self.logger.error(
+                f'Failed to get emails with IDs {message_set(email_ids)}')
+            return []
+
+        parts = []
+        for response_part in msg_data:
+            header = response_part[0] if isinstance(
+                response_part, tuple) else response_part
+            if isinstance(header, bytes) and header[:1].isdigit():
+                parts.append(
+                    (header.split(b' ', 1)[0].decode(), response_part))
+        return parts
+
+    @timed_operation
+    def fetch_email_uids(self, criteria: IMAPSearchCriteria) -> Tuple[Optional[List[bytes]], float]:
+        """
+        Same as `fetch_email_ids` but returns UIDs, which stay stable across
+        sessions and can be used to checkpoint long running jobs.
+        """
+        try:
+            status, data = self.connection.uid('SEARCH', None, criteria.build())
+            if status == 'OK':
+                return data[0].split()
+            self.logger.error(f'Status not OK: {status}')
+        except Exception as e:
+            self.logger.exception(f'Error fetching email UIDs: {e}')
+        return None
+
+    def fetch_emails_by_uids(self, uids: List[bytes]) -> List[Tuple[bytes, Message]]:
+        """
+        Fetch a batch of emails with a single UID FETCH command.
+
+        Returns:
+            List[Tuple[bytes, Message]]: (uid, message) pairs sorted by uid.
+        """
+        if not uids:
+            return []
+        status, msg_data = self.connection.uid(
+            'FETCH', message_set(uids), '(UID RFC822)')
+        if status != 'OK':
+            raise ValueError(f'Failed to fetch emails with UIDs {uids}')
+
+        emails: List[Tuple[bytes, Message]] = []
+        for index, response_part in enumerate(msg_data):
+            if not isinstance(response_part, tuple):
+                continue
+            match = UID_PATTERN.search(response_part[0])
+            # Some servers send the UID after the message literal
+            if match is None and index + 1 < len(msg_data) and isinstance(msg_data[index + 1], bytes):
+                match = UID_PATTERN.search(msg_data[index + 1])
+            if match is None:
+                self.logger.error(
+                    f'Missing UID in fetch response: {response_part[0]}')
+                continue
+            emails.append(
+                (match.group(1), email.message_from_bytes(response_part[1])))
+        emails.sort(key=lambda item: int(item[0]))
         return emails
 
     def disconnect(self):
@@ -1,9 +1,27 @@
 import logging
 from pathlib import Path
-from typing import Literal
+from typing import List, Literal, Optional
 
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+RELATIVE_DATE_PATTERN = r'^(today|tomorrow|month_start|next_month_start)?([+-]\d+d)?$'
+
+
+class WarmupQuery(BaseModel):
+    """
+    Query kept hot by the warm-up scheduler.
+
+    `start` and `end` are relative to the day the query runs: `today`,
+    `tomorrow`, `month_start` or `next_month_start`, optionally followed by a
+    day offset such as `today-7d` (a bare `-7d` is relative to today).
+    """
+    mailbox: str = 'inbox'
+    start: str = Field(default='today', pattern=RELATIVE_DATE_PATTERN)
+    end: str = Field(default='tomorrow', pattern=RELATIVE_DATE_PATTERN)
+    senders: Optional[List[str]] = None
+    subjects: Optional[List[str]] = None
+
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
@@ -17,7 +35,35 @@ class Settings(BaseSettings):
     PAGE_SIZE: int = 15
     CACHE_CAPACITY_EMAIL_ID_LIST: int = 5
     CACHE_CAPACITY_EMAIL_MODEL_LIST: int = 5
+    CACHE_CAPACITY_MESSAGES: int = 500
+    SEARCH_INDEX_CAPACITY: int = 20000
+    CACHE_BACKEND: Literal['memory', 'redis'] = 'memory'
+    CACHE_URL: Optional[str] = None
+    CACHE_TTL_SECONDS: Optional[float] = 86400.0
+    CACHE_QUERY_TTL_SECONDS: Optional[float] = 900.0
+    NEAR_CACHE_TTL_SECONDS: float = 30.0
+    VALIDATE_CACHED_EMAILS: bool = False
+    GMAIL_EXTENSIONS: bool = True
+    IMAP_MAX_CONNECTIONS: int = 4
+    IMAP_TARGET_LATENCY: float = 5.0
+    IMAP_THROTTLE_RETRIES: int = 2
+    IMAP_CONNECTION_WAIT_SECONDS: float = 10.0
+    PARALLEL_FETCH_MIN_CHUNK: int = 10
+    STATS_BATCH_SIZE: int = 5000
+    ADMISSION_MAX_CONCURRENT: int = 8
+    ADMISSION_MAX_QUEUE: int = 32
+    ADMISSION_MAX_WAIT_SECONDS: float = 5.0
+    IMAP_REQUESTS_PER_MINUTE: float = 30.0
+    IMAP_REQUESTS_BURST: int = 10
+    WARMUP_QUERIES: List[WarmupQuery] = []
+    WARMUP_INTERVAL_SECONDS: float = 600.0
+    WARMUP_PAGES: int = 1
+    WARMUP_DELAY_SECONDS: float = 2.0
     ENVIRONMENT: Literal['local', 'development', 'production'] = 'local'
+    EXPORT_DIR: Path = Path('exports')
+    EXPORT_BATCH_SIZE: int = 50
+    EXPORT_QUEUE_SIZE: int = 4
+    EXPORT_CONNECTIONS: int = 2
 
 
 config = Settings()
@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import uuid
+from collections import deque
+from datetime import datetime
+from email.message import Message
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .client import EmailClient
+from .models import (ConnectionsBusyException, ExportJobModel, ExportRequest,
+                     ExportStatus, ImapServer)
+from .utils.admission import AdmissionController
+from .utils.concurrency import account_connection_slots
+from .utils.imap_search_criteria import define_criteria, define_gmail_criteria
+from .utils.parser import parse_email_records
+from .utils.search_index import SearchIndex
+from .utils.writers import ExportItem, ExportWriter, get_output_path, get_writer
+
+
+class ExportManager:
+    """
+    Runs bulk exports of a mailbox range as background jobs.
+
+    Every job is a fetch -> parse -> write pipeline connected by bounded
+    queues, so a slow writer throttles the IMAP fetches instead of buffering
+    the whole range in memory. After each written batch the highest UID is
+    checkpointed next to the output file, which lets a failed or interrupted
+    job be resumed without exporting the same emails twice.
+
+    Batches are fetched over up to `connections` IMAP connections and written
+    in order. Only the first connection waits for an account slot, the others
+    are opened when a slot is free so exports never starve live requests.
+    With `admission` the search and every batch take a token of the account
+    rate limit shared with the API.
+    """
+
+    def __init__(
+        self,
+        email_user: str,
+        email_pass: str,
+        server: ImapServer,
+        export_dir: Path,
+        batch_size: int = 50,
+        queue_size: int = 4,
+        search_index: Optional[SearchIndex] = None,
+        max_connections: int = 4,
+        gmail_extensions: bool = False,
+        connections: int = 1,
+        connection_wait: float = 10.0,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.email_user = email_user
+        self.email_pass = email_pass
+        self.server = server
+        self.export_dir = export_dir
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.search_index = search_index
+        self.connection_slots = account_connection_slots(
+            email_user, max_connections)
+        self.gmail_extensions = gmail_extensions
+        self.connections = connections
+        self.connection_wait = connection_wait
+        self.admission = admission
+        self.jobs: Dict[str, ExportJobModel] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def _get_client(self, mailbox: str) -> EmailClient:
+        return EmailClient(email_user=self.email_user, email_pass=self.email_pass, server=self.server.value, mailbox=mailbox)
+
+    def _checkpoint_path(self, job_id: str) -> Path:
+        return self.export_dir / f'{job_id}.json'
+
+    def _save(self, job: ExportJobModel) -> None:
+        job.updated_at = datetime.now()
+        self._checkpoint_path(job.id).write_text(job.model_dump_json())
+
+    def get(self, job_id: str) -> ExportJobModel:
+        job = self.jobs.get(job_id)
+        if job is None:
+            path = self._checkpoint_path(job_id)
+            if not path.is_file():
+                raise LookupError(f'Export job {job_id} not found')
+            job = ExportJobModel.model_validate_json(path.read_text())
+            self.jobs[job_id] = job
+        return job
+
+    def start(self, request: ExportRequest) -> ExportJobModel:
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        now = datetime.now()
+        job = ExportJobModel(
+            id=job_id,
+            request=request,
+            output_path=str(get_output_path(
+                self.export_dir, job_id, request.format)),
+            created_at=now,
+            updated_at=now
+        )
+        writer = get_writer(request.format, Path(job.output_path))
+        self.jobs[job_id] = job
+        self._save(job)
+        self._schedule(job, writer)
+        return job
+
+    def resume(self, job_id: str) -> ExportJobModel:
+        job = self.get(job_id)
+        task = self.tasks.get(job_id)
+        if job.status == ExportStatus.COMPLETED or (task and not task.done()):
+            return job
+        writer = get_writer(job.request.format, Path(job.output_path))
+        job.error = None
+        self._save(job)
+        self._schedule(job, writer)
+        return job
+
+    def _schedule(self, job: ExportJobModel, writer: ExportWriter) -> None:
+        self.tasks[job.id] = asyncio.create_task(self._run(job, writer))
+
+    async def _take_token(self) -> None:
+        if self.admission is not None:
+            await self.admission.take_token(self.email_user)
+
+    async def _open_client(self, mailbox: str, wait: bool) -> Optional[EmailClient]:
+        """
+        Connect taking an account slot, None when `wait` is False and every slot is taken.
+
+        Raises:
+            ConnectionsBusyException: No slot was released within `connection_wait` seconds.
+        """
+        if not wait:
+            if not self.connection_slots.acquire(blocking=False):
+                return None
+        elif not await asyncio.to_thread(self.connection_slots.acquire, timeout=self.connection_wait):
+            raise ConnectionsBusyException(
+                f'Every connection to the email server is busy, waited {self.connection_wait:.0f} seconds')
+        client = self._get_client(mailbox)
+        try:
+            await asyncio.to_thread(client.connect)
+        except BaseException:
+            self.connection_slots.release()
+            raise
+        return client
+
+    async def _close_clients(self, clients: List[EmailClient]) -> None:
+        for client in clients:
+            await asyncio.to_thread(client.disconnect)
+            self.connection_slots.release()
+
+    async def _run(self, job: ExportJobModel, writer: ExportWriter) -> None:
+        job.status = ExportStatus.RUNNING
+        self._save(job)
+        clients: List[EmailClient] = []
+        try:
+            # Wait for the rate limit before holding a connection slot
+            await self._take_token()
+            clients.append(await self._open_client(job.request.mailbox, wait=True))
+            self._check_uid_validity(job, clients[0])
+            uids = await self._search(clients[0], job)
+            pending = [uid for uid in uids if int(uid) > job.last_uid]
+            job.total_items = len(uids)
+            job.exported_items = len(uids) - len(pending)
+            self._save(job)
+            batches = -(-len(pending) // self.batch_size)
+            while len(clients) < min(self.connections, batches):
+                client = await self._open_client(job.request.mailbox, wait=False)
+                if client is None:
+                    break
+                clients.append(client)
+            self.logger.info(
+                f'[EXPORT:{job.id}] {len(pending)} of {len(uids)} emails left to export over {len(clients)} connections')
+
+            fetched: asyncio.Queue[Optional[List[Tuple[bytes, Message]]]] = asyncio.Queue(
+                maxsize=self.queue_size)
+            parsed: asyncio.Queue[Optional[List[ExportItem]]] = asyncio.Queue(
+                maxsize=self.queue_size)
+            async with asyncio.TaskGroup() as group:
+                group.create_task(self._fetch_stage(clients, pending, fetched))
+                group.create_task(self._parse_stage(
+                    job.request.mailbox, fetched, parsed))
+                group.create_task(self._write_stage(job, writer, parsed))
+
+            job.status = ExportStatus.COMPLETED
+            self.logger.info(
+                f'[EXPORT:{job.id}] Completed {job.exported_items} emails into {job.output_path}')
+        except Exception as e:
+            errors = e.exceptions if isinstance(e, ExceptionGroup) else [e]
+            job.status = ExportStatus.FAILED
+            job.error = '. '.join(str(error) for error in errors)
+            self.logger.exception(f'[EXPORT:{job.id}] Failed: {job.error}')
+        finally:
+            self._save(job)
+            await self._close_clients(clients)
+            writer.close()
+
+    def _check_uid_validity(self, job: ExportJobModel, client: EmailClient) -> None:
+        # A rebuilt mailbox renumbers its UIDs, the checkpoint would skip or repeat emails
+        if job.last_uid and job.uid_validity is not None and job.uid_validity != client.uid_validity:
+            raise ValueError(
+                f'The UIDVALIDITY of {job.request.mailbox} changed from {job.uid_validity} to '
+                f'{client.uid_validity}, the job can not be resumed, start a new export')
+        job.uid_validity = client.uid_validity
+
+    async def _search(self, client: EmailClient, job: ExportJobModel) -> List[bytes]:
+        build_criteria = define_gmail_criteria if self.gmail_extensions else define_criteria
+        criteria = build_criteria(
+            job.request.start_date, job.request.end_date, job.request.senders, job.request.subjects)
+        uids, _ = await asyncio.to_thread(client.fetch_email_uids, criteria)
+        if uids is None:
+            raise ValueError(
+                f'Unable to search emails for the given criteria = {criteria.build()}')
+        return sorted(uids, key=int)
+
+    async def _fetch_stage(self, clients: List[EmailClient], uids: List[bytes], output: asyncio.Queue) -> None:
+        idle: asyncio.Queue[EmailClient] = asyncio.Queue()
+        for client in clients:
+            idle.put_nowait(client)
+
+        async def fetch(batch: List[bytes]) -> List[Tuple[bytes, Message]]:
+            await self._take_token()
+            client = await idle.get()
+            try:
+                return await asyncio.to_thread(client.fetch_emails_by_uids, batch)
+            finally:
+                idle.put_nowait(client)
+
+        # One batch in flight per connection, handed over in uid order for the checkpoints
+        in_flight: deque[asyncio.Task] = deque()
+        try:
+            for offset in range(0, len(uids), self.batch_size):
+                in_flight.append(asyncio.create_task(
+                    fetch(uids[offset:offset + self.batch_size])))
+                if len(in_flight) >= len(clients):
+                    await output.put(await in_flight.popleft())
+            while in_flight:
+                await output.put(await in_flight.popleft())
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        await output.put(None)
+
+    async def _parse_stage(self, mailbox: str, source: asyncio.Queue, output: asyncio.Queue) -> None:
+        def parse(emails: List[Tuple[bytes, Message]]) -> List[ExportItem]:
+            records = parse_email_records([msg for _, msg in emails])
+            if self.search_index is not None:
+                self.search_index.add(mailbox, records)
+            return [(uid, msg, record.to_model(validate=True))
+                    for (uid, msg), record in zip(emails, records)]
+
+        while (emails := await source.get()) is not None:
+            await output.put(await asyncio.to_thread(parse, emails))
+        await output.put(None)
+
+    def _write_batch(self, job: ExportJobModel, writer: ExportWriter, items: List[ExportItem]) -> None:
+        writer.write_batch(items)
+        job.last_uid = int(items[-1][0])
+        job.exported_items += len(items)
+        self._save(job)
+
+    async def _write_stage(self, job: ExportJobModel, writer: ExportWriter, source: asyncio.Queue) -> None:
+        while (items := await source.get()) is not None:
+            if not items:
+                continue
+            write = asyncio.ensure_future(asyncio.to_thread(
+                self._write_batch, job, writer, items))
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # A batch written without its checkpoint would be exported twice on resume
+                await write
+                raise
@@ -1,19 +1,24 @@
-import json
 import logging
+import math
 from http import HTTPStatus
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from fastapi import APIRouter, Depends, FastAPI, Path, Query, Request
-from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 
 from .config import config
+from .export import ExportManager
 from .models import (ApiResponse, AuthException, CursorModel, DateRange, EmailMessageModel,
-                     ImapServer, Meta, PaginatedResponse,
-                     PydanticValidationError)
+                     ExportJobModel, ExportRequest, ImapServer, Meta,
+                     OverloadedException, PaginatedResponse,
+                     PydanticValidationError, RateLimitedException,
+                     StatsResponse, StatsSource, ThrottledException)
 from .service import EmailService
-from .utils import configure_root_logger
+from .utils import (AdmissionController, PydanticJSONResponse,
+                    configure_root_logger, validate_group_by)
+from .warmup import WarmupScheduler
 
 app = FastAPI()
 
@@ -30,14 +35,52 @@ email_service = EmailService(
     server=ImapServer.GOOGLE
 )
 
+admission_controller = AdmissionController(
+    max_concurrent=config.ADMISSION_MAX_CONCURRENT,
+    max_queue=config.ADMISSION_MAX_QUEUE,
+    rate=config.IMAP_REQUESTS_PER_MINUTE / 60,
+    burst=config.IMAP_REQUESTS_BURST,
+    max_wait=config.ADMISSION_MAX_WAIT_SECONDS
+)
+
+export_manager = ExportManager(
+    email_user=config.EMAIL_USER,
+    email_pass=config.EMAIL_PASSWORD,
+    server=ImapServer.GOOGLE,
+    export_dir=config.EXPORT_DIR,
+    batch_size=config.EXPORT_BATCH_SIZE,
+    queue_size=config.EXPORT_QUEUE_SIZE,
+    search_index=email_service.search_index,
+    max_connections=config.IMAP_MAX_CONNECTIONS,
+    gmail_extensions=email_service.gmail_extensions,
+    connections=config.EXPORT_CONNECTIONS,
+    connection_wait=config.IMAP_CONNECTION_WAIT_SECONDS,
+    admission=admission_controller
+)
+
+warmup_scheduler = WarmupScheduler(
+    service=email_service,
+    queries=config.WARMUP_QUERIES,
+    interval=config.WARMUP_INTERVAL_SECONDS,
+    pages=config.WARMUP_PAGES,
+    page_size=config.PAGE_SIZE,
+    delay=config.WARMUP_DELAY_SECONDS,
+    admission=admission_controller
+)
+
+
+@app.on_event("startup")
+async def start_warmup():
+    warmup_scheduler.start()
+
 
-def respond_with(response: ApiResponse) -> JSONResponse:
-    content = jsonable_encoder(response)
-    json_content = json.dumps(content)
-    content_length = len(json_content.encode('utf-8'))
+@app.on_event("shutdown")
+async def stop_warmup():
+    await warmup_scheduler.stop()
 
-    headers = {"Content-Length": str(content_length)}
-    return JSONResponse(status_code=response.meta.status, content=content, headers=headers)
+
+def respond_with(response: ApiResponse, headers: Optional[Dict[str, str]] = None) -> PydanticJSONResponse:
+    return PydanticJSONResponse(status_code=response.meta.status, content=response, headers=headers)
 
 
 @app.exception_handler(RequestValidationError)
@@ -72,7 +115,83 @@ async def custom_validation_exception_handler(request: Request, exc: ValueError)
         })
 
 
-@app.get("/{mailbox}", response_model=ApiResponse[PaginatedResponse[EmailMessageModel]])
+@app.exception_handler(RateLimitedException)
+async def rate_limited_exception_handler(request: Request, exc: RateLimitedException):
+    status_code = HTTPStatus.SERVICE_UNAVAILABLE if isinstance(
+        exc, OverloadedException) else HTTPStatus.TOO_MANY_REQUESTS
+    return respond_with(
+        ApiResponse(meta=Meta(status=status_code, message=exc.args[0])),
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
+
+@app.post("/exports", response_model=ApiResponse[ExportJobModel], status_code=HTTPStatus.ACCEPTED)
+async def create_export(request: ExportRequest):
+    job = export_manager.start(request)
+    return respond_with(ApiResponse(meta=Meta(status=HTTPStatus.ACCEPTED), data=job))
+
+
+@app.get("/exports/{job_id}", response_model=ApiResponse[ExportJobModel])
+async def read_export(job_id: str = Path(..., description="Export job id")):
+    try:
+        job = export_manager.get(job_id)
+        return respond_with(ApiResponse(meta=Meta(status=HTTPStatus.OK), data=job))
+    except LookupError as le:
+        return respond_with(ApiResponse(meta=Meta(status=HTTPStatus.NOT_FOUND, message=le.args[0])))
+
+
+@app.post("/exports/{job_id}/resume", response_model=ApiResponse[ExportJobModel], status_code=HTTPStatus.ACCEPTED)
+async def resume_export(job_id: str = Path(..., description="Export job id")):
+    try:
+        job = export_manager.resume(job_id)
+        return respond_with(ApiResponse(meta=Meta(status=HTTPStatus.ACCEPTED), data=job))
+    except LookupError as le:
+        return respond_with(ApiResponse(meta=Meta(status=HTTPStatus.NOT_FOUND, message=le.args[0])))
+
+
+# Mailboxes can contain slashes ([Gmail]/All Mail), these routes go last so they
+# don't shadow the others and stats goes first so it isn't read as a mailbox
+@app.get("/{mailbox:path}/stats", response_model=ApiResponse[StatsResponse])
+async def read_stats(
+    mailbox: str = Path(..., description="Mailbox to get the data from"),
+    date_range: DateRange = Depends(),
+    group_by: str = Query(
+        'sender,day', description="Comma separated fields to group by: sender, domain, hour, day, week, month, weekday"),
+    senders: Optional[str] = Query(
+        None, description="List of email senders to filter by. Use semicolon separated values"),
+    subject: Optional[List[str]] = Query(
+        None, description="List of strings that could match a subject"),
+    source: StatsSource = Query(
+        StatsSource.IMAP, description="Count emails from the IMAP server or from the local index of fetched emails"),
+):
+    fields = [field.strip() for field in group_by.split(',') if field.strip()]
+    # Invalid requests must not spend rate limit tokens
+    validate_group_by(fields)
+    try:
+        with warmup_scheduler.live_request():
+            async with admission_controller.admit(config.EMAIL_USER, cached=source == StatsSource.INDEX):
+                result = await run_in_threadpool(
+                    email_service.get_stats,
+                    start_date=date_range.start_date,
+                    end_date=date_range.end_date,
+                    group_by=fields,
+                    senders=senders.split(';') if senders else None,
+                    subjects=subject,
+                    mailbox=mailbox,
+                    source=source
+                )
+        return respond_with(result)
+    except AuthException as ae:
+        return respond_with(ApiResponse(meta=Meta(
+            status=HTTPStatus.UNAUTHORIZED, message=ae.args[0], request_time=0.0)
+        ))
+    except ThrottledException as te:
+        return respond_with(ApiResponse(meta=Meta(
+            status=HTTPStatus.SERVICE_UNAVAILABLE, message=te.args[0], request_time=0.0)
+        ))
+
+
+@app.get("/{mailbox:path}", response_model=ApiResponse[PaginatedResponse[EmailMessageModel]])
 # @catch_standard_errors
 async def read_emails(
     mailbox: str = Path(..., description="Mailbox to get the data from"),
@@ -85,26 +204,45 @@ async def read_emails(
         None, description="List of email senders to filter by. Use semicolon separated values"),
     subject: Optional[List[str]] = Query(
         None, description="List of strings that could match a subject"),
+    q: Optional[str] = Query(
+        None, description="Free text search over the subject, sender and body of already fetched emails"),
 ):
-    email_service.mailbox = mailbox
     cursor = CursorModel(
         page=page, page_size=page_size, cursor=cursor)
 
     try:
-        result = email_service.get_paginated(
-            start_date=date_range.start_date,
-            end_date=date_range.end_date,
-            cursor=cursor,
-            senders=senders.split(';') if senders else None,
-            subjects=subject
-        )
-        return JSONResponse(status_code=result.meta.status, content=jsonable_encoder(result.model_dump()))
+        with warmup_scheduler.live_request():
+            if q:
+                return respond_with(await run_in_threadpool(
+                    email_service.search,
+                    q,
+                    start_date=date_range.start_date,
+                    end_date=date_range.end_date,
+                    cursor=cursor,
+                    senders=senders.split(';') if senders else None,
+                    subjects=subject,
+                    mailbox=mailbox
+                ))
+            query = dict(
+                start_date=date_range.start_date,
+                end_date=date_range.end_date,
+                cursor=cursor,
+                senders=senders.split(';') if senders else None,
+                subjects=subject,
+                mailbox=mailbox
+            )
+            cached = await run_in_threadpool(email_service.is_cached, **query)
+            async with admission_controller.admit(config.EMAIL_USER, cached):
+                result = await run_in_threadpool(email_service.get_paginated, **query)
+        return respond_with(result)
     except AuthException as ae:
-        return JSONResponse(
-            status_code=HTTPStatus.UNAUTHORIZED,
-            content=jsonable_encoder(ApiResponse(meta=Meta(
-                status=HTTPStatus.UNAUTHORIZED, message=ae.args[0], request_time=0.0)
-            )))
+        return respond_with(ApiResponse(meta=Meta(
+            status=HTTPStatus.UNAUTHORIZED, message=ae.args[0], request_time=0.0)
+        ))
+    except ThrottledException as te:
+        return respond_with(ApiResponse(meta=Meta(
+            status=HTTPStatus.SERVICE_UNAVAILABLE, message=te.args[0], request_time=0.0)
+        ))
 
 
 app.include_router(router)
@@ -2,9 +2,10 @@ import base64
 import json
 from datetime import datetime
 from enum import Enum
-from typing import Generic, List, Optional, TypeVar
+from typing import Dict, Generic, List, NamedTuple, Optional, Tuple, TypeVar
 
-from pydantic import BaseModel, EmailStr, Field, model_validator
+from pydantic import (BaseModel, EmailStr, Field, field_serializer,
+                      model_validator)
 
 from .config import config
 
@@ -16,6 +17,24 @@ class AuthException(Exception):
     pass
 
 
+class ThrottledException(Exception):
+    pass
+
+
+class ConnectionsBusyException(ThrottledException):
+    pass
+
+
+class RateLimitedException(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OverloadedException(RateLimitedException):
+    pass
+
+
 class DateRange(BaseModel):
     start_date: datetime = Field(...,
                                  description="Start date in ISO format (YYYY-MM-DD)")
@@ -66,6 +85,112 @@ class EmailMessageModel(BaseModel):
     date: Optional[datetime]
     body: Optional[str]
 
+    @field_serializer('date', when_used='json-unless-none')
+    def serialize_date(self, date: datetime) -> str:
+        # Keep the "+00:00" offsets of the previous encoder, pydantic writes UTC as "Z"
+        return date.isoformat()
+
+
+# Part of the cache namespace, bump it when a cached value changes shape
+CACHE_SCHEMA_VERSION = 3
+
+
+class EmailRecord(NamedTuple):
+    """
+    Compact representation of a parsed email used internally and in caches.
+
+    Records are produced by our own parser so they are trusted, the pydantic
+    `EmailMessageModel` is only built at the API boundary.
+    """
+    subject: Optional[str]
+    from_email: Optional[str]
+    to_emails: Tuple[str, ...]
+    date: Optional[datetime]
+    body: Optional[str]
+    message_id: Optional[str] = None
+
+    def to_model(self, validate: bool = False) -> EmailMessageModel:
+        """
+        Convert the record into the response model.
+
+        Args:
+            validate (bool): Run pydantic validation instead of `model_construct`.
+
+        Returns:
+            EmailMessageModel: The model exposed by the API.
+        """
+        if validate:
+            return EmailMessageModel(
+                subject=self.subject,
+                from_email=self.from_email,
+                to_emails=list(self.to_emails),
+                date=self.date,
+                body=self.body
+            )
+        return EmailMessageModel.model_construct(
+            subject=self.subject,
+            from_email=self.from_email,
+            to_emails=list(self.to_emails),
+            date=self.date,
+            body=self.body
+        )
+
+
+class StatsSource(str, Enum):
+    IMAP = 'imap'
+    INDEX = 'index'
+
+
+class StatsGroup(BaseModel):
+    key: Dict[str, str]
+    count: int
+
+
+class StatsResponse(BaseModel):
+    group_by: List[str]
+    total_items: int
+    groups: List[StatsGroup]
+
+
+class ExportFormat(str, Enum):
+    JSONL = 'jsonl'
+    MBOX = 'mbox'
+    PARQUET = 'parquet'
+
+
+class ExportStatus(str, Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+
+class ExportRequest(BaseModel):
+    mailbox: str = Field(..., description="Mailbox to export")
+    start_date: datetime = Field(...,
+                                 description="Start date in ISO format (YYYY-MM-DD)")
+    end_date: datetime = Field(...,
+                               description="End date in ISO format (YYYY-MM-DD)")
+    senders: Optional[List[str]] = None
+    subjects: Optional[List[str]] = None
+    format: ExportFormat = ExportFormat.JSONL
+
+
+class ExportJobModel(BaseModel):
+    id: str
+    request: ExportRequest
+    status: ExportStatus = ExportStatus.PENDING
+    output_path: str
+    total_items: Optional[int] = None
+    exported_items: int = 0
+    last_uid: int = Field(
+        default=0, description="Highest UID written, used to resume the job")
+    uid_validity: Optional[int] = Field(
+        default=None, description="UIDVALIDITY of the mailbox the UIDs belong to")
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
 
 class CursorModel(BaseModel):
     page_size: Optional[int] = Field(
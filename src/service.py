@@ -1,14 +1,30 @@
+import hashlib
 import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+from email.message import Message
 from http import HTTPStatus
-from typing import Callable, List, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
-from .client import EmailClient
-from .models import (ApiResponse, CursorModel, EmailMessageModel, ImapServer,
-                     Meta, PaginatedResponse, PaginationMeta)
-from .utils.cache import LRUCache
-from .utils.imap_search_criteria import IMAPSearchCriteria, define_criteria
-from .utils.parser import parse_email_message
+from .client import EmailClient, normalize_id
+from .config import config
+from .models import (CACHE_SCHEMA_VERSION, ApiResponse,
+                     ConnectionsBusyException, CursorModel,
+                     EmailMessageModel, EmailRecord, ImapServer, Meta, PaginatedResponse, PaginationMeta,
+                     StatsGroup, StatsResponse, StatsSource,
+                     ThrottledException)
+from .utils.aggregation import count_by, validate_group_by
+from .utils.cache import CacheBackend, create_cache
+from .utils.concurrency import AIMDController, account_connection_slots
+from .utils.imap_search_criteria import (IMAPSearchCriteria, define_criteria,
+                                         define_gmail_criteria)
+from .utils.parser import parse_email_records
+from .utils.search_index import SearchIndex
 
 
 class EmailService:
@@ -17,10 +33,32 @@ class EmailService:
         self.email_pass = email_pass
         self.server = server
         self.__mailbox = mailbox
-        self.ids_cache = LRUCache[List[str]](capacity=3)
-        self.email_cache = LRUCache[List[EmailMessageModel]](capacity=3)
+        # Search results change as emails arrive, they expire sooner than emails
+        self.ids_cache: CacheBackend[List[str]] = self._create_cache(
+            'ids', config.CACHE_CAPACITY_EMAIL_ID_LIST, config.CACHE_QUERY_TTL_SECONDS)
+        self.email_cache: CacheBackend[List[EmailRecord]] = self._create_cache(
+            'emails', config.CACHE_CAPACITY_EMAIL_MODEL_LIST, config.CACHE_QUERY_TTL_SECONDS)
+        # Parsed emails by X-GM-MSGID, shared by every Gmail label
+        self.message_cache: CacheBackend[EmailRecord] = self._create_cache(
+            'messages', config.CACHE_CAPACITY_MESSAGES, config.CACHE_TTL_SECONDS)
+        self.gmail_extensions = config.GMAIL_EXTENSIONS and server == ImapServer.GOOGLE
+        self.search_index = SearchIndex(capacity=config.SEARCH_INDEX_CAPACITY)
+        self.connection_slots = account_connection_slots(
+            email_user, config.IMAP_MAX_CONNECTIONS)
+        self.concurrency = AIMDController(
+            maximum=config.IMAP_MAX_CONNECTIONS, target_latency=config.IMAP_TARGET_LATENCY)
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    def _create_cache(self, namespace: str, capacity: int, ttl: Optional[float]) -> CacheBackend:
+        return create_cache(
+            namespace=f'email_reader:v{CACHE_SCHEMA_VERSION}:{self.email_user}:{namespace}',
+            capacity=capacity,
+            backend=config.CACHE_BACKEND,
+            url=config.CACHE_URL,
+            ttl=ttl,
+            near_ttl=config.NEAR_CACHE_TTL_SECONDS
+        )
+
     @property
     def mailbox(self) -> str:
         return self.__mailbox
@@ -29,21 +67,187 @@ class EmailService:
     def mailbox(self, label: str):
         self.__mailbox = label
 
-    def _get_client(self) -> EmailClient:
-        return EmailClient(email_user=self.email_user, email_pass=self.email_pass, server=self.server.value, mailbox=self.mailbox)
+    def _get_client(self, mailbox: Optional[str] = None) -> EmailClient:
+        return EmailClient(email_user=self.email_user, email_pass=self.email_pass, server=self.server.value, mailbox=mailbox or self.mailbox)
+
+    @contextmanager
+    def _connect(self, mailbox: Optional[str] = None) -> Iterator[EmailClient]:
+        # Every connection takes one of the account slots while it is open
+        if not self.connection_slots.acquire(timeout=config.IMAP_CONNECTION_WAIT_SECONDS):
+            raise ConnectionsBusyException(
+                f'Every connection to the email server is busy, waited {config.IMAP_CONNECTION_WAIT_SECONDS:.0f} seconds')
+        try:
+            with self._get_client(mailbox) as client:
+                yield client
+        finally:
+            self.connection_slots.release()
+
+    def _fetch_emails(
+        self, email_ids: List[str], mailbox: str, max_connections: Optional[int] = None,
+        client: Optional[EmailClient] = None
+    ) -> Tuple[List[Tuple[str, Message]], float]:
+        """
+        Fetch emails splitting the ids across up to `concurrency.limit` connections.
+
+        Chunks are pulled by one worker per connection and merged back in the
+        order of `email_ids`. A throttled worker puts its chunk back and stops,
+        the remaining chunks are retried with backoff on fewer connections.
+        A worker that finds every account slot busy leaves its chunks to the
+        others, when there are none the fetch fails right away.
+
+        Args:
+            client (EmailClient): Connection already open on `mailbox`, used by
+                the first worker instead of logging in again.
+        """
+        if not email_ids:
+            return [], 0.0
+        start_time = time.perf_counter()
 
-    def _generate_cache_key(self, criteria: IMAPSearchCriteria) -> str:
-        return hash(str(criteria.build())+self.mailbox)
+        def connection_limit() -> int:
+            return min(self.concurrency.limit, max_connections or self.concurrency.maximum)
+
+        chunk_size = max(config.PARALLEL_FETCH_MIN_CHUNK,
+                         math.ceil(len(email_ids) / connection_limit()))
+        pending = deque(enumerate(
+            email_ids[offset:offset + chunk_size] for offset in range(0, len(email_ids), chunk_size)))
+        results: Dict[int, List[Tuple[str, Message]]] = {}
+        lock = threading.Lock()
+        running = [0]
+        open_clients = [client] if client is not None else []
+
+        def fetch_chunks(client: EmailClient) -> None:
+            while True:
+                with lock:
+                    # Give the connection back if throttling lowered the limit
+                    if not pending or running[0] > connection_limit():
+                        running[0] -= 1
+                        return
+                    index, chunk = pending.popleft()
+                try:
+                    emails, latency = client.fetch_email_map(chunk)
+                except ThrottledException:
+                    with lock:
+                        pending.appendleft((index, chunk))
+                    raise
+                self.concurrency.on_success(latency)
+                results[index] = [(email_id, emails[email_id])
+                                  for email_id in map(normalize_id, chunk) if email_id in emails]
+
+        def worker() -> None:
+            with lock:
+                # A throttled connection may be closed, retries open new ones
+                open_client = open_clients.pop() if open_clients else None
+            try:
+                connection = nullcontext(open_client) if open_client else self._connect(mailbox)
+                with connection as worker_client:
+                    fetch_chunks(worker_client)
+            except ConnectionsBusyException:
+                with lock:
+                    running[0] -= 1
+                    if running[0] or not pending:
+                        return
+                raise
+            except ThrottledException as te:
+                self.logger.warning(f'[THROTTLED] {te}')
+                self.concurrency.on_throttle()
+                with lock:
+                    running[0] -= 1
+
+        for attempt in range(config.IMAP_THROTTLE_RETRIES + 1):
+            if attempt:
+                time.sleep(2 ** (attempt - 1))
+            workers = min(connection_limit(), len(pending))
+            self.logger.debug(
+                f'Fetching {len(pending)} chunks with {workers} connections')
+            running[0] = workers
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(worker) for _ in range(workers)]:
+                    future.result()
+            if not pending:
+                break
+        else:
+            raise ThrottledException(
+                f'The email server kept throttling after {config.IMAP_THROTTLE_RETRIES} retries')
+
+        emails = [email for index in sorted(results) for email in results[index]]
+        return emails, time.perf_counter() - start_time
+
+    def _fetch_records(
+        self, email_ids: List[str], mailbox: str, max_connections: Optional[int] = None
+    ) -> Tuple[List[EmailRecord], float]:
+        if not self.gmail_extensions:
+            emails, time_emails = self._fetch_emails(
+                email_ids, mailbox, max_connections)
+            return parse_email_records([email for _, email in emails]), time_emails
+
+        with self._connect(mailbox) as client:
+            if not client.supports_gmail_extensions:
+                self.logger.warning('The email server does not support X-GM-MSGID lookups')
+                emails, time_emails = self._fetch_emails(
+                    email_ids, mailbox, max_connections, client)
+                return parse_email_records([email for _, email in emails]), time_emails
+
+            # Look emails up by X-GM-MSGID so the ones already fetched through
+            # another label are not downloaded again
+            message_ids, time_ids = client.fetch_gmail_message_ids(email_ids)
+            email_ids = [normalize_id(email_id) for email_id in email_ids]
+            records: Dict[str, EmailRecord] = {}
+            missing: List[str] = []
+            for email_id in email_ids:
+                message_id = message_ids.get(email_id)
+                record = self.message_cache.get(message_id) if message_id else None
+                if record is None:
+                    missing.append(email_id)
+                else:
+                    records[email_id] = record
+            self.logger.info(
+                f'[CACHE:FOUND] {len(records)} of {len(email_ids)} emails by X-GM-MSGID')
+
+            emails, time_emails = self._fetch_emails(
+                missing, mailbox, max_connections, client)
+        parsed = parse_email_records([email for _, email in emails])
+        for (email_id, _), record in zip(emails, parsed):
+            records[email_id] = record
+            if email_id in message_ids:
+                self.message_cache.put(
+                    message_ids[email_id], records[email_id])
+        return [records[email_id] for email_id in email_ids if email_id in records], time_ids + time_emails
+
+    def _generate_cache_key(self, criteria: IMAPSearchCriteria, mailbox: str) -> str:
+        # Must be stable across processes to be shared through the cache server
+        return hashlib.sha1(f'{mailbox}:{criteria.build()}'.encode()).hexdigest()
+
+    def _page_cache_key(self, cache_key: str, cursor: CursorModel) -> str:
+        return f'{cache_key}:{cursor.page}:{cursor.page_size}'
+
+    def is_cached(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        cursor: CursorModel,
+        senders: Optional[List[str]] = None,
+        subjects: Optional[List[str]] = None,
+        mailbox: Optional[str] = None,
+    ) -> bool:
+        """Whether `get_paginated` can answer from the caches without contacting the server."""
+        mailbox = mailbox or self.mailbox
+        build_criteria = define_gmail_criteria if self.gmail_extensions else define_criteria
+        cache_key = self._generate_cache_key(
+            build_criteria(start_date, end_date, senders, subjects), mailbox)
+        return self.ids_cache.get(cache_key) is not None and \
+            self.email_cache.get(self._page_cache_key(cache_key, cursor)) is not None
 
-    def __get_email_ids(self, cache_key: str, criteria: IMAPSearchCriteria) -> Tuple[ApiResponse | List[str], float]:
-        email_ids = self.ids_cache.get(cache_key)
+    def __get_email_ids(
+        self, cache_key: str, criteria: IMAPSearchCriteria, mailbox: str, refresh: bool = False
+    ) -> Tuple[ApiResponse | List[str], float]:
+        email_ids = None if refresh else self.ids_cache.get(cache_key)
 
         query = criteria.build()
 
         if email_ids is None:
             self.logger.info('No ids cache found')
             # Only create a client if needed
-            with self._get_client() as client:
+            with self._connect(mailbox) as client:
                 email_ids, time_ids = client.fetch_email_ids(criteria)
                 if not email_ids:
                     return ApiResponse(
@@ -61,30 +265,151 @@ class EmailService:
             return email_ids, 0.0
 
     def __get_emails_by_id(
-        self, cache_key: str, email_ids: List[str], criteria: IMAPSearchCriteria, cursor: CursorModel
+        self,
+        cache_key: str,
+        email_ids: List[str],
+        criteria: IMAPSearchCriteria,
+        cursor: CursorModel,
+        mailbox: str,
+        refresh: bool = False,
+        max_connections: Optional[int] = None,
     ) -> Tuple[ApiResponse[PaginatedResponse[EmailMessageModel]], float]:
-        cache_key = f'{cache_key}{cursor.page}{cursor.page_size}'
-        emails = self.email_cache.get(cache_key)
+        cache_key = self._page_cache_key(cache_key, cursor)
+        records = None if refresh else self.email_cache.get(cache_key)
         time_email = 0.0
-        if emails is None:
+        # Freshly parsed records are validated once, cached ones are trusted
+        validate = config.VALIDATE_CACHED_EMAILS
+        if records is None:
             self.logger.info('No emails cache found')
-            with self._get_client() as client:
-                emails, time_email = client.fetch_emails_by_ids(email_ids)
-                self.email_cache.put(cache_key, emails)
-                self.logger.info(
-                    f'[CACHE:SAVED] {len(emails)} for {criteria.build()} in emails cache')
+            records, time_email = self._fetch_records(
+                email_ids, mailbox, max_connections)
+            self.email_cache.put(cache_key, records)
+            self.search_index.add(mailbox, records)
+            self.logger.info(
+                f'[CACHE:SAVED] {len(records)} for {criteria.build()} in emails cache')
+            validate = True
         else:
             self.logger.info(f'Used emails cache for {criteria.build()}')
 
         response = ApiResponse(
-            meta=Meta(status=HTTPStatus.OK if len(emails)
+            meta=Meta(status=HTTPStatus.OK if len(records)
                       > 0 else HTTPStatus.PARTIAL_CONTENT),
-            data=PaginatedResponse(
-                items=[parse_email_message(email) for email in emails]
+            data=PaginatedResponse[EmailMessageModel].model_construct(
+                pagination=None,
+                items=[record.to_model(validate=validate)
+                       for record in records]
             )
         )
         return response, time_email
 
+    def _paginate(self, total_items: int, cursor: CursorModel) -> PaginationMeta:
+        total_pages = (total_items + cursor.page_size - 1) // cursor.page_size
+
+        next_cursor = CursorModel(
+            page=cursor.page+1, page_size=cursor.page_size).encode() if cursor.page < total_pages else None
+        prev_cursor = CursorModel(
+            page=cursor.page-1, page_size=cursor.page_size).encode() if cursor.page > 1 else None
+
+        return PaginationMeta(
+            total_items=total_items,
+            total_pages=total_pages,
+            page_size=cursor.page_size,
+            current_page=cursor.page,
+            next_cursor=next_cursor,
+            prev_cursor=prev_cursor
+        )
+
+    def search(
+        self,
+        query: str,
+        start_date: datetime,
+        end_date: datetime,
+        cursor: CursorModel,
+        senders: Optional[List[str]] = None,
+        subjects: Optional[List[str]] = None,
+        mailbox: Optional[str] = None,
+    ) -> ApiResponse[PaginatedResponse[EmailMessageModel]]:
+        """
+        Full text search over the local index, no IMAP command is sent.
+
+        Only emails that were already fetched (pages or exports) are indexed.
+        """
+        start_time = time.perf_counter()
+        records = self.search_index.search(
+            query, mailbox=mailbox or self.mailbox, start_date=start_date, end_date=end_date,
+            senders=senders, subjects=subjects)
+        offset = (cursor.page - 1) * cursor.page_size
+        page = records[offset:offset + cursor.page_size]
+
+        return ApiResponse(
+            meta=Meta(
+                status=HTTPStatus.OK if page else HTTPStatus.PARTIAL_CONTENT,
+                message=f'Found {len(records)} items matching "{query}" in {len(self.search_index)} indexed emails',
+                request_time=time.perf_counter() - start_time
+            ),
+            data=PaginatedResponse[EmailMessageModel].model_construct(
+                pagination=self._paginate(len(records), cursor),
+                items=[record.to_model(validate=config.VALIDATE_CACHED_EMAILS)
+                       for record in page]
+            )
+        )
+
+    def get_stats(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        group_by: List[str],
+        senders: Optional[List[str]] = None,
+        subjects: Optional[List[str]] = None,
+        mailbox: Optional[str] = None,
+        source: StatsSource = StatsSource.IMAP,
+    ) -> ApiResponse[StatsResponse]:
+        """
+        Count the emails matching the criteria grouped by `group_by`.
+
+        With the IMAP source only the INTERNALDATE and From header of every
+        email are fetched, in batches of STATS_BATCH_SIZE on one connection.
+        The index source reads the emails already fetched.
+        """
+        validate_group_by(group_by)
+        mailbox = mailbox or self.mailbox
+        start_time = time.perf_counter()
+        if source == StatsSource.INDEX:
+            records = self.search_index.records_matching(
+                mailbox=mailbox, start_date=start_date, end_date=end_date, senders=senders, subjects=subjects)
+            dates = [record.date for record in records]
+            from_emails = [record.from_email for record in records]
+        else:
+            build_criteria = define_gmail_criteria if self.gmail_extensions else define_criteria
+            criteria = build_criteria(start_date, end_date, senders, subjects)
+            email_ids, _ = self.__get_email_ids(
+                self._generate_cache_key(criteria, mailbox), criteria, mailbox)
+            dates, from_emails = [], []
+            # No emails found, the empty stats need no connection
+            if email_ids and not isinstance(email_ids, ApiResponse):
+                with self._connect(mailbox) as client:
+                    for offset in range(0, len(email_ids), config.STATS_BATCH_SIZE):
+                        headers, _ = client.fetch_email_headers(
+                            email_ids[offset:offset + config.STATS_BATCH_SIZE])
+                        for date, from_email in headers:
+                            dates.append(date)
+                            from_emails.append(from_email)
+
+        groups = count_by(dates, from_emails, group_by)
+        return ApiResponse(
+            meta=Meta(
+                status=HTTPStatus.OK if dates else HTTPStatus.PARTIAL_CONTENT,
+                message=f'Counted {len(dates)} emails in {len(groups)} groups',
+                request_time=time.perf_counter() - start_time
+            ),
+            data=StatsResponse(
+                group_by=group_by,
+                total_items=len(dates),
+                groups=[StatsGroup(key=key, count=count)
+                        for key, count in groups]
+            )
+        )
+
     def get_paginated(
         self,
         start_date: datetime,
@@ -93,13 +418,26 @@ class EmailService:
         senders: Optional[List[str]] = None,
         subjects: Optional[List[str]] = None,
         filter_criteria: Optional[Callable[[EmailMessageModel], bool]] = None,
+        mailbox: Optional[str] = None,
+        refresh: bool = False,
+        max_connections: Optional[int] = None,
     ) -> ApiResponse[PaginatedResponse[EmailMessageModel]]:
+        """
+        Get a page of the emails matching the criteria, using the caches when possible.
 
-        criteria = define_criteria(start_date, end_date, senders, subjects)
-        cache_key = self._generate_cache_key(criteria)
+        Args:
+            mailbox (str): Mailbox to read, defaults to `self.mailbox`.
+            refresh (bool): Skip the cached ids and page, the result is cached again.
+            max_connections (int): Cap on the connections used to fetch the page.
+        """
+        mailbox = mailbox or self.mailbox
+        build_criteria = define_gmail_criteria if self.gmail_extensions else define_criteria
+        criteria = build_criteria(start_date, end_date, senders, subjects)
+        cache_key = self._generate_cache_key(criteria, mailbox)
 
         # 2. Get email ids
-        email_ids, time_ids = self.__get_email_ids(cache_key, criteria)
+        email_ids, time_ids = self.__get_email_ids(
+            cache_key, criteria, mailbox, refresh)
 
         if isinstance(email_ids, ApiResponse):
             return email_ids
@@ -111,7 +449,7 @@ class EmailService:
         paginated_email_ids = email_ids[offset:offset + cursor.page_size]
 
         email_response, time_emails = self.__get_emails_by_id(
-            cache_key, paginated_email_ids, criteria, cursor)
+            cache_key, paginated_email_ids, criteria, cursor, mailbox, refresh, max_connections)
 
         if email_response.meta == HTTPStatus.PARTIAL_CONTENT:
             return email_response
@@ -131,24 +469,7 @@ class EmailService:
             self.logger.info(f'Total images retrieved = {len()}')
 
         total_items = len(email_ids)
-        total_pages = (total_items + cursor.page_size - 1) // cursor.page_size
-
-        next_cursor = CursorModel(
-            page=cursor.page+1, page_size=cursor.page_size).encode() if cursor.page < total_pages else None
-        prev_cursor = CursorModel(
-            page=cursor.page-1, page_size=cursor.page_size).encode() if cursor.page > 1 else None
-
-        # Add pagination metadata
-        pagination_meta = PaginationMeta(
-            total_items=total_items,
-            total_pages=total_pages,
-            page_size=cursor.page_size,
-            current_page=cursor.page,
-            next_cursor=next_cursor,
-            prev_cursor=prev_cursor
-        )
-
-        email_response.data.pagination = pagination_meta
+        email_response.data.pagination = self._paginate(total_items, cursor)
 
         # add complete time elapsed
         elapsed_time = time_emails + time_ids
@@ -1,5 +1,13 @@
-from .cache import LRUCache
+from .cache import CacheBackend, LRUCache, NearCache, RedisCache, create_cache
 from .decorators import catch_standard_errors, timed_operation
-from .imap_search_criteria import IMAPSearchCriteria, define_criteria
+from .imap_search_criteria import (GmailSearchCriteria, IMAPSearchCriteria,
+                                   define_criteria, define_gmail_criteria)
 from .logging import configure_root_logger
-from .parser import parse_email_message
+from .headers import decode_header_value, decode_headers
+from .parser import parse_email_message, parse_email_record, parse_email_records
+from .writers import ExportWriter, get_writer
+from .responses import PydanticJSONResponse
+from .search_index import SearchIndex
+from .concurrency import AIMDController, account_connection_slots
+from .aggregation import GROUP_BY_FIELDS, count_by, validate_group_by
+from .admission import AdmissionController, TokenBucket
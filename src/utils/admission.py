@@ -0,0 +1,137 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from ..models import OverloadedException, RateLimitedException
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `capacity`.
+
+    `reserve` always takes a token and returns how long the caller has to wait
+    for it, so waiting callers are served in order instead of racing.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def cancel(self) -> None:
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class AdmissionController:
+    """
+    Admission control in front of the email service.
+
+    - Requests that need the IMAP server take a token of the account bucket,
+      when the wait for a token is longer than `max_wait` they are rejected
+      with `RateLimitedException` (429).
+    - At most `max_concurrent` requests run at once, up to `max_queue` more
+      wait for a slot and the rest are rejected with `OverloadedException` (503).
+    - Waiting requests answered from the caches get a slot before the ones
+      that need a fresh fetch.
+    - Background jobs (exports, warm-up) share the account buckets through
+      `take_token`, they wait for their turn instead of being rejected.
+    """
+
+    CACHED, FRESH = 0, 1
+
+    def __init__(self, max_concurrent: int, max_queue: int, rate: float, burst: int, max_wait: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.running = 0
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.counter = itertools.count()
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def _bucket(self, account: str) -> TokenBucket:
+        if account not in self.buckets:
+            self.buckets[account] = TokenBucket(self.rate, self.burst)
+        return self.buckets[account]
+
+    async def take_token(self, account: str, max_wait: Optional[float] = None) -> None:
+        """
+        Wait for a token of the `account` bucket before sending IMAP commands.
+
+        Raises:
+            RateLimitedException: The wait would be longer than `max_wait`.
+        """
+        bucket = self._bucket(account)
+        wait = bucket.reserve()
+        if max_wait is not None and wait > max_wait:
+            bucket.cancel()
+            raise RateLimitedException(
+                f'Too many requests to the email server for {account}, retry in {wait:.0f} seconds', retry_after=wait)
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                bucket.cancel()
+                raise
+
+    async def _acquire_slot(self, priority: int) -> None:
+        if self.running < self.max_concurrent and not self.waiters:
+            self.running += 1
+            return
+        if len(self.waiters) >= self.max_queue:
+            raise OverloadedException(
+                'The server is busy, try again later', retry_after=1.0)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over right before the cancellation
+                self._release_slot()
+            else:
+                self.waiters = [
+                    waiter for waiter in self.waiters if waiter[2] is not future]
+                heapq.heapify(self.waiters)
+            raise
+
+    def _release_slot(self) -> None:
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # The slot goes straight to the waiter, running stays the same
+                future.set_result(None)
+                return
+        self.running -= 1
+
+    @asynccontextmanager
+    async def admit(self, account: str, cached: bool) -> AsyncIterator[None]:
+        if not cached:
+            await self.take_token(account, self.max_wait)
+        try:
+            await self._acquire_slot(self.CACHED if cached else self.FRESH)
+        except (OverloadedException, asyncio.CancelledError):
+            if not cached:
+                # The request never reached the email server, give its token back
+                self._bucket(account).cancel()
+            raise
+        try:
+            yield
+        finally:
+            self._release_slot()
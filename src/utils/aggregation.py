@@ -0,0 +1,98 @@
+from collections import Counter
+from datetime import datetime
+from email.utils import parseaddr
+from typing import Callable, Dict, List, Optional, Tuple
+
+UNKNOWN = 'unknown'
+
+
+def _sender_column(senders: List[Optional[str]]) -> List[str]:
+    # Most pages repeat a handful of senders, parse each distinct header once
+    parsed: Dict[Optional[str], str] = {}
+    column = []
+    for sender in senders:
+        if sender not in parsed:
+            address = parseaddr(sender)[1] if sender else ''
+            parsed[sender] = address.lower() or UNKNOWN
+        column.append(parsed[sender])
+    return column
+
+
+def _date_column(bucket: Callable[[datetime], object], fmt: str) -> Callable[[List[Optional[datetime]]], List[str]]:
+    def column(dates: List[Optional[datetime]]) -> List[str]:
+        # Format every bucket once, strftime dominates the cost otherwise
+        labels: Dict[object, str] = {}
+        values = []
+        for date in dates:
+            if date is None:
+                values.append(UNKNOWN)
+                continue
+            key = bucket(date)
+            label = labels.get(key)
+            if label is None:
+                label = labels[key] = date.strftime(fmt)
+            values.append(label)
+        return values
+    return column
+
+
+def _day(date: datetime):
+    return date.date()
+
+
+def _hour(date: datetime):
+    return (date.date(), date.hour)
+
+
+DATE_GROUPS: Dict[str, Callable[[List[Optional[datetime]]], List[str]]] = {
+    'hour': _date_column(_hour, '%Y-%m-%d %H:00'),
+    'day': _date_column(_day, '%Y-%m-%d'),
+    'week': _date_column(_day, '%G-W%V'),
+    'month': _date_column(_day, '%Y-%m'),
+    'weekday': _date_column(_day, '%A'),
+}
+GROUP_BY_FIELDS = ['sender', 'domain', *DATE_GROUPS]
+
+
+def validate_group_by(group_by: List[str]) -> None:
+    unknown = [field for field in group_by if field not in GROUP_BY_FIELDS]
+    if unknown:
+        raise ValueError(
+            f'Unable to group by {", ".join(unknown)}, use any of {", ".join(GROUP_BY_FIELDS)}')
+
+
+def count_by(
+    dates: List[Optional[datetime]],
+    senders: List[Optional[str]],
+    group_by: List[str],
+) -> List[Tuple[Dict[str, str], int]]:
+    """
+    Count emails grouped by sender and/or date buckets.
+
+    The input is columnar (one list per field). Every requested group becomes
+    a key column computed in a single pass, then rows are counted by the
+    tuple of their keys.
+
+    Args:
+        dates (List[Optional[datetime]]): Date of each email.
+        senders (List[Optional[str]]): From header of each email.
+        group_by (List[str]): Fields of `GROUP_BY_FIELDS` to group by.
+
+    Returns:
+        List[Tuple[Dict[str, str], int]]: (group key, count) sorted by key.
+    """
+    validate_group_by(group_by)
+
+    columns: List[List[str]] = []
+    sender_column: Optional[List[str]] = None
+    for field in group_by:
+        if field in ('sender', 'domain'):
+            if sender_column is None:
+                sender_column = _sender_column(senders)
+            columns.append(sender_column if field == 'sender' else
+                           [sender.rpartition('@')[2] for sender in sender_column])
+        else:
+            columns.append(DATE_GROUPS[field](dates))
+
+    counts = Counter(zip(*columns)) if columns else Counter({(): len(dates)})
+    return [(dict(zip(group_by, key)), count) for key, count in sorted(counts.items())]
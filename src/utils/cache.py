@@ -1,22 +1,300 @@
-from typing import Generic, Optional, OrderedDict, TypeVar
+import json
+import logging
+import socket
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Generic, List, Optional, OrderedDict, Tuple, TypeVar
+from urllib.parse import urlparse
+
+from ..models import EmailRecord
 
 T = TypeVar('T')
 
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(ABC, Generic[T]):
+    """Interface shared by every cache tier, keys are always strings."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[T]:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, value: T) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
 
-class LRUCache(Generic[T]):
-    def __init__(self, capacity: int):
-        self.cache: OrderedDict[str, T] = OrderedDict()
+class LRUCache(CacheBackend[T]):
+    def __init__(self, capacity: int, ttl: Optional[float] = None):
+        self.cache: OrderedDict[str, Tuple[float, T]] = OrderedDict()
         self.capacity = capacity
+        self.ttl = ttl
+        self.lock = threading.Lock()
 
     def get(self, key: str) -> Optional[T]:
-        if key in self.cache:
-            self.cache.move_to_end(key)
-            return self.cache[key]
-        return None
+        with self.lock:
+            if key in self.cache:
+                expires_at, value = self.cache[key]
+                if expires_at < time.monotonic():
+                    del self.cache[key]
+                    return None
+                self.cache.move_to_end(key)
+                return value
+            return None
 
     def put(self, key: str, value: T) -> None:
-        if key in self.cache:
-            self.cache.move_to_end(key)
-        self.cache[key] = value
-        if len(self.cache) > self.capacity:
-            self.cache.popitem(last=False)
+        expires_at = time.monotonic() + self.ttl if self.ttl else float('inf')
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            self.cache[key] = (expires_at, value)
+            if len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            self.cache.pop(key, None)
+
+
+COMPRESSION_THRESHOLD = 1024
+RAW, COMPRESSED = b'\x00', b'\x01'
+
+
+def _encode(value):
+    # EmailRecord is a tuple, json would write it as a plain list
+    if isinstance(value, EmailRecord):
+        date = value.date.isoformat() if value.date else None
+        return {'record': [value.subject, value.from_email, list(value.to_emails),
+                           date, value.body, value.message_id]}
+    if isinstance(value, bytes):
+        return {'bytes': value.decode('latin-1')}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        raise TypeError('Cannot cache dicts, they are used to tag values')
+    return value
+
+
+def _decode(tagged: dict):
+    if 'record' in tagged:
+        subject, from_email, to_emails, date, body, message_id = tagged['record']
+        return EmailRecord(subject, from_email, tuple(to_emails),
+                           datetime.fromisoformat(date) if date else None, body, message_id)
+    if 'bytes' in tagged:
+        return tagged['bytes'].encode('latin-1')
+    raise ValueError(f'Unknown cached value {tagged}')
+
+
+def serialize(value) -> bytes:
+    """
+    Encode `value` as JSON and zlib compress it when it is larger than 1KB.
+
+    Only strings, numbers, bytes, lists and `EmailRecord` are supported.
+    Unlike pickle, loading an entry written by someone else cannot run code.
+    """
+    data = json.dumps(_encode(value), ensure_ascii=False,
+                      separators=(',', ':')).encode()
+    if len(data) > COMPRESSION_THRESHOLD:
+        return COMPRESSED + zlib.compress(data, 1)
+    return RAW + data
+
+
+def deserialize(data: bytes):
+    if data[:1] == COMPRESSED:
+        data = zlib.decompress(data[1:])
+    else:
+        data = data[1:]
+    return json.loads(data, object_hook=_decode)
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    """Minimal RESP client, enough for GET/SET/DEL without a redis dependency."""
+
+    def __init__(self, url: str, timeout: float = 1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> None:
+        self.sock = socket.create_connection(
+            (self.host, self.port), timeout=self.timeout)
+        self.reader = self.sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.db:
+            self._call('SELECT', str(self.db))
+
+    def close(self) -> None:
+        if self.sock:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+                self.reader = None
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the cache server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            return self.reader.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f'Unknown reply from the cache server: {line}')
+
+    def _call(self, *args: str | bytes):
+        parts: List[bytes] = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            arg = arg.encode() if isinstance(arg, str) else arg
+            parts.append(f'${len(arg)}\r\n'.encode() + arg + b'\r\n')
+        self.sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def execute(self, *args: str | bytes):
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self._connect()
+                return self._call(*args)
+            except (OSError, ConnectionError):
+                self.close()
+                raise
+
+
+class RedisCache(CacheBackend[T]):
+    """
+    Cache stored in a redis compatible server shared by every worker.
+
+    Failures of the cache server are logged and behave like a miss, so the
+    API keeps working (fetching from IMAP) when the cache tier is down.
+    """
+
+    def __init__(self, url: str, namespace: str, ttl: Optional[float] = None):
+        self.connection = RedisConnection(url)
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _key(self, key: str) -> str:
+        return f'{self.namespace}:{key}'
+
+    def get(self, key: str) -> Optional[T]:
+        try:
+            data = self.connection.execute('GET', self._key(key))
+        except (OSError, RedisError) as e:
+            logger.warning(f'Cache server unavailable: {e}')
+            return None
+        if data is None:
+            return None
+        try:
+            return deserialize(data)
+        except Exception as e:
+            # Corrupt or written by another version
+            logger.warning(f'Dropping unreadable cache entry {key}: {e!r}')
+            self.delete(key)
+            return None
+
+    def put(self, key: str, value: T) -> None:
+        args = ['SET', self._key(key), serialize(value)]
+        if self.ttl:
+            args += ['PX', str(int(self.ttl * 1000))]
+        try:
+            self.connection.execute(*args)
+        except (OSError, RedisError) as e:
+            logger.warning(f'Cache server unavailable: {e}')
+
+    def delete(self, key: str) -> None:
+        try:
+            self.connection.execute('DEL', self._key(key))
+        except (OSError, RedisError) as e:
+            logger.warning(f'Cache server unavailable: {e}')
+
+
+class NearCache(CacheBackend[T]):
+    """
+    Small in process LRU in front of a shared cache.
+
+    Hot keys are served without a network round trip, the short `ttl` of the
+    local tier bounds how long a worker can miss updates from the others.
+    """
+
+    def __init__(self, local: LRUCache[T], remote: CacheBackend[T]):
+        self.local = local
+        self.remote = remote
+
+    def get(self, key: str) -> Optional[T]:
+        value = self.local.get(key)
+        if value is None:
+            value = self.remote.get(key)
+            if value is not None:
+                self.local.put(key, value)
+        return value
+
+    def put(self, key: str, value: T) -> None:
+        self.local.put(key, value)
+        self.remote.put(key, value)
+
+    def delete(self, key: str) -> None:
+        self.local.delete(key)
+        self.remote.delete(key)
+
+
+def create_cache(
+    namespace: str,
+    capacity: int,
+    backend: str = 'memory',
+    url: Optional[str] = None,
+    ttl: Optional[float] = None,
+    near_ttl: Optional[float] = None,
+) -> CacheBackend:
+    """
+    Build the cache tier for `namespace`.
+
+    Args:
+        namespace (str): Prefix of the keys in the shared tier.
+        capacity (int): Number of entries kept in process.
+        backend (str): 'memory' for an in process LRU or 'redis' for a shared cache.
+        url (str): Url of the redis server, e.g. redis://localhost:6379/0.
+        ttl (float): Seconds before an entry expires.
+        near_ttl (float): Seconds an entry of the shared tier is kept in process.
+    """
+    if backend == 'memory':
+        return LRUCache(capacity=capacity, ttl=ttl)
+    if backend == 'redis':
+        if not url:
+            raise ValueError('A redis url is required for the redis cache')
+        return NearCache(
+            local=LRUCache(capacity=capacity, ttl=near_ttl),
+            remote=RedisCache(url=url, namespace=namespace, ttl=ttl)
+        )
+    raise ValueError(f'Unknown cache backend {backend}')
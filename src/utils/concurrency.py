@@ -0,0 +1,60 @@
+import threading
+from typing import Dict
+
+_account_slots: Dict[str, threading.BoundedSemaphore] = {}
+_account_slots_lock = threading.Lock()
+
+
+def account_connection_slots(account: str, limit: int) -> threading.BoundedSemaphore:
+    """
+    Semaphore shared by everything that opens IMAP connections for `account`.
+
+    Providers cap simultaneous connections per account (Gmail allows 15), so
+    the cap has to hold across services and export jobs, not per object.
+    """
+    with _account_slots_lock:
+        if account not in _account_slots:
+            _account_slots[account] = threading.BoundedSemaphore(limit)
+        return _account_slots[account]
+
+
+class AIMDController:
+    """
+    Additive increase / multiplicative decrease of a concurrency limit.
+
+    Every successful operation that finishes within `target_latency` adds
+    `increase / limit`, so the limit grows by about `increase` per round of
+    `limit` operations. A throttling response multiplies it by `decrease`.
+    """
+
+    def __init__(
+        self,
+        maximum: int,
+        minimum: int = 1,
+        initial: int = 1,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        target_latency: float = 5.0,
+    ):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def on_success(self, latency: float) -> None:
+        if latency > self.target_latency:
+            return
+        with self._lock:
+            self._limit = min(self.maximum, self._limit +
+                              self.increase / int(self._limit))
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self._limit = max(self.minimum, self._limit * self.decrease)
@@ -0,0 +1,97 @@
+import base64
+import binascii
+import codecs
+import html
+import re
+from email.header import Header, decode_header, make_header
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+
+ENCODED_WORD = re.compile(
+    r'=\?([^?*]+)(?:\*[^?]*)?\?([BbQq])\?([^?]*)\?=')
+FOLDING = re.compile(r'\r?\n(?=[ \t])')
+
+
+@lru_cache(maxsize=64)
+def lookup_charset(charset: str) -> str:
+    """Normalized codec name of a MIME charset, utf-8 for unknown charsets."""
+    try:
+        return codecs.lookup(charset.strip().lower()).name
+    except LookupError:
+        return 'utf-8'
+
+
+def decode_encoded_word(encoding: str, text: str) -> bytes:
+    """Bytes of the payload of a RFC 2047 encoded-word."""
+    if encoding in 'Bb':
+        try:
+            return base64.b64decode(text + '=' * (-len(text) % 4))
+        except binascii.Error:
+            return text.encode('ascii', errors='replace')
+    return binascii.a2b_qp(text.encode('ascii', errors='replace'), header=True)
+
+
+def _decode_encoded_words(value: str) -> str:
+    chunks: List[Tuple[Optional[str], bytes | str]] = []
+    position = 0
+    for match in ENCODED_WORD.finditer(value):
+        between = value[position:match.start()]
+        # Whitespace between two encoded-words is not part of the text
+        if between and not (chunks and chunks[-1][0] and between.isspace()):
+            chunks.append((None, between))
+        charset = lookup_charset(match.group(1))
+        payload = decode_encoded_word(match.group(2), match.group(3))
+        # Join adjacent words of a charset first, a character can be split across words
+        if chunks and chunks[-1][0] == charset:
+            chunks[-1] = (charset, chunks[-1][1] + payload)
+        else:
+            chunks.append((charset, payload))
+        position = match.end()
+    chunks.append((None, value[position:]))
+    return ''.join(
+        text if charset is None else text.decode(charset, errors='replace')
+        for charset, text in chunks)
+
+
+@lru_cache(maxsize=4096)
+def _decode_header_value(value: str) -> str:
+    value = FOLDING.sub('', value)
+    if '=?' in value:
+        value = _decode_encoded_words(value)
+    if '&' in value:
+        value = html.unescape(value)
+    return value
+
+
+def decode_header_value(value: Optional[str | Header]) -> Optional[str]:
+    """
+    Decode a header that might contain RFC 2047 encoded-words.
+
+    Plain headers only get unfolded, encoded-words are decoded with their
+    own charset and adjacent words are joined. Decoded values are cached,
+    the same From and Subject headers repeat a lot across a mailbox.
+    """
+    if value is None:
+        return None
+    if isinstance(value, Header):
+        # Raw 8 bit headers, let the email package handle their charset
+        return html.unescape(str(make_header(decode_header(value))))
+    return _decode_header_value(value)
+
+
+# Reset the decoded values like the cache of any lru_cache function
+decode_header_value.cache_clear = _decode_header_value.cache_clear
+
+
+def decode_headers(values: Iterable[Optional[str | Header]]) -> List[Optional[str]]:
+    """Decode the headers of a whole page at once, each distinct value is decoded once."""
+    decoded = {}
+    result = []
+    for value in values:
+        if isinstance(value, Header) or value is None:
+            result.append(decode_header_value(value))
+            continue
+        if value not in decoded:
+            decoded[value] = _decode_header_value(value)
+        result.append(decoded[value])
+    return result
@@ -1,5 +1,8 @@
+import re
 from datetime import datetime
-from typing import List, Optional
+from typing import Callable, List, Optional
+
+EMAIL_ADDRESS = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
 
 
 class IMAPSearchCriteria:
@@ -109,3 +112,73 @@ def define_criteria(
         criteria.and_(*and_conditions)
 
     return criteria
+
+
+class GmailSearchCriteria(IMAPSearchCriteria):
+    """
+    Criteria using Gmail's X-GM-RAW extension, which accepts the same query
+    syntax as the Gmail search box and is evaluated by Gmail's own index.
+    """
+
+    def raw(self, query: str):
+        escaped = query.replace('\\', '\\\\').replace('"', '\\"')
+        self.criteria.append(f'X-GM-RAW "{escaped}"')
+        return self
+
+
+def _gmail_term(operator: str, value: str) -> str:
+    if any(c in value for c in ' (){}"'):
+        value = '"' + value.replace('"', '') + '"'
+    return f'{operator}:{value}'
+
+
+def _gmail_any(operator: str, values: List[str]) -> str:
+    terms = [_gmail_term(operator, value) for value in values]
+    return terms[0] if len(terms) == 1 else '{' + ' '.join(terms) + '}'
+
+
+def _imap_any(term: Callable[[IMAPSearchCriteria, str], IMAPSearchCriteria], values: List[str]) -> str:
+    conditions = [term(IMAPSearchCriteria(), value).build() for value in values]
+    return conditions[0] if len(conditions) == 1 else IMAPSearchCriteria().or_(*conditions).build()
+
+
+def define_gmail_criteria(
+    start_date: datetime,
+    end_date: datetime,
+    senders: Optional[List[str]] = None,
+    subjects: Optional[List[str]] = None,
+) -> IMAPSearchCriteria:
+    """
+    Same search as `define_criteria` with the dates and senders compiled to a
+    flat X-GM-RAW query, several senders become a `{from:a from:b}` group.
+
+    Gmail's `from:` and `subject:` match whole words while IMAP FROM and
+    SUBJECT match substrings, so subjects and senders that are not complete
+    addresses stay as standard criteria (Gmail ANDs them with X-GM-RAW).
+    IMAP commands are sent as ASCII, so queries with non ASCII values fall
+    back to the standard criteria.
+    """
+    values = (senders or []) + (subjects or [])
+    if not all(value.isascii() for value in values):
+        return define_criteria(start_date, end_date, senders, subjects)
+
+    terms = [
+        f'after:{start_date.strftime("%Y/%m/%d")}',
+        f'before:{end_date.strftime("%Y/%m/%d")}',
+    ]
+    substring_conditions: List[str] = []
+    if senders:
+        if all(EMAIL_ADDRESS.fullmatch(sender) for sender in senders):
+            terms.append(_gmail_any('from', senders))
+        else:
+            substring_conditions.append(
+                _imap_any(IMAPSearchCriteria.from_, senders))
+    subjects = [subject for subject in subjects or [] if subject]
+    if subjects:
+        substring_conditions.append(
+            _imap_any(IMAPSearchCriteria.subject, subjects))
+
+    criteria = GmailSearchCriteria().raw(' '.join(terms))
+    if substring_conditions:
+        criteria.and_(*substring_conditions)
+    return criteria
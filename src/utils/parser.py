@@ -1,34 +1,36 @@
 import base64
-import html
 import quopri
 import re
-from email.header import decode_header, make_header
 from email.message import Message
-from email.utils import parsedate_to_datetime
+from email.utils import getaddresses, parsedate_to_datetime
+from functools import lru_cache
 from logging import getLogger
+from typing import List, Optional
 
 from bs4 import BeautifulSoup
+from pydantic import EmailStr, TypeAdapter, ValidationError
 
-from ..models import EmailMessageModel
+from ..models import EmailMessageModel, EmailRecord
+from .headers import decode_header_value, decode_headers, lookup_charset
 
+logger = getLogger(__name__)
 
-def decode_base64(encoded_str: str) -> str:
+
+def decode_base64(encoded_str: str, charset: str = 'utf-8') -> str:
     """Decode a base64 encoded string."""
     decoded_bytes = base64.b64decode(encoded_str)
-    return decoded_bytes.decode('utf-8')
+    return decoded_bytes.decode(lookup_charset(charset), errors='replace')
 
 
-def decode_quoted_printable(encoded_str: str) -> str:
+def decode_quoted_printable(encoded_str: str, charset: str = 'utf-8') -> str:
     """Decode a quoted-printable encoded string."""
     decoded_bytes = quopri.decodestring(encoded_str)
-    return decoded_bytes.decode('utf-8')
+    return decoded_bytes.decode(lookup_charset(charset), errors='replace')
 
 
 def decode(subject: str) -> str:
     """Decode an email subject that might be encoded."""
-    decoded_header = str(make_header(decode_header(subject)))
-    unescaped_header = html.unescape(decoded_header)
-    return unescaped_header
+    return decode_header_value(subject)
 
 
 def decode_match(encoded_str: str) -> str:
@@ -37,13 +39,38 @@ def decode_match(encoded_str: str) -> str:
     if match:
         charset, encoding, encoded_text = match.groups()
         if encoding == 'B':
-            return decode_base64(encoded_text)
+            return decode_base64(encoded_text, charset)
         elif encoding == 'Q':
-            return decode_quoted_printable(encoded_text)
+            return decode_quoted_printable(encoded_text, charset)
     return encoded_str
 
 
+EMAIL_ADDRESS = TypeAdapter(EmailStr)
+
+
+@lru_cache(maxsize=4096)
+def normalize_address(address: str) -> Optional[str]:
+    """Address as `EmailStr` normalizes it, None when it would be rejected (e.g. root@localhost)."""
+    try:
+        return EMAIL_ADDRESS.validate_python(address)
+    except ValidationError:
+        logger.debug(f'Ignoring invalid recipient {address}')
+        return None
+
+
 def parse_email_message(msg: Message) -> EmailMessageModel:
+    return parse_email_record(msg).to_model(validate=True)
+
+
+def parse_email_records(msgs: List[Message]) -> List[EmailRecord]:
+    """Parse a page of emails, decoding the subject and From headers of the page in one batch."""
+    headers = decode_headers(
+        [msg.get(name) for msg in msgs for name in ('subject', 'from')])
+    return [parse_email_record(msg, subject=headers[2 * index], from_email=headers[2 * index + 1])
+            for index, msg in enumerate(msgs)]
+
+
+def parse_email_record(msg: Message, subject: Optional[str] = None, from_email: Optional[str] = None) -> EmailRecord:
 
     def parse_message_body(msg: Message) -> str:
         try:
@@ -78,19 +105,24 @@ def parse_email_message(msg: Message) -> EmailMessageModel:
         except Exception as e:
             raise e
 
-    subject = decode(msg.get('subject'))
-    from_email = decode(msg.get('from'))
-    to_emails = msg.get_all('to', [])
+    if subject is None:
+        subject = decode(msg.get('subject'))
+    if from_email is None:
+        from_email = decode(msg.get('from'))
+    # Records are cached and indexed unvalidated, invalid recipients are dropped here instead
+    to_emails = tuple(filter(None, (normalize_address(address) for _, address in getaddresses(
+        msg.get_all('to', [])) if address)))
     date = msg.get('date')
 
     # Parse the date if it exists
     if date:
         date = parsedate_to_datetime(date)
 
-    return EmailMessageModel(
+    return EmailRecord(
         subject=subject,
         from_email=from_email,
         to_emails=to_emails,
         date=date,
-        body=parse_message_body(msg)
+        body=parse_message_body(msg),
+        message_id=msg.get('message-id')
     )
@@ -0,0 +1,20 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+class PydanticJSONResponse(JSONResponse):
+    """
+    JSON response that serializes pydantic models straight to bytes.
+
+    `JSONResponse` runs the content through `jsonable_encoder` and `json.dumps`,
+    walking every item twice in Python. Models are instead dumped in one pass by
+    pydantic's rust serializer. Anything that is not a model falls back to the
+    default rendering.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.model_dump_json().encode('utf-8')
+        return super().render(content)
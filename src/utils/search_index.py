@@ -0,0 +1,189 @@
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from ..models import EmailRecord
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Split text into lowercase tokens without accents ("Transacción" -> "transaccion")."""
+    if not text:
+        return []
+    normalized = unicodedata.normalize('NFKD', text.casefold())
+    stripped = ''.join(c for c in normalized if not unicodedata.combining(c))
+    return TOKEN_PATTERN.findall(stripped)
+
+
+class SearchIndex:
+    """
+    In memory inverted index over parsed emails ranked with BM25.
+
+    Emails are added incrementally as they are fetched and identified by their
+    Message-ID, so the same email seen in several mailboxes is indexed once.
+    Subject tokens count `subject_boost` times to rank subject matches higher.
+    At most `capacity` emails are kept, the least recently added are evicted
+    together with their postings.
+    """
+
+    def __init__(self, capacity: Optional[int] = None, k1: float = 1.2, b: float = 0.75, subject_boost: int = 3):
+        self.capacity = capacity
+        self.k1 = k1
+        self.b = b
+        self.subject_boost = subject_boost
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.records: OrderedDict[int, EmailRecord] = OrderedDict()
+        self.tokens: Dict[int, Tuple[str, ...]] = {}
+        self.lengths: Dict[int, int] = {}
+        self.mailboxes: Dict[int, Set[str]] = {}
+        self.keys: Dict[str, int] = {}
+        self.next_doc = 0
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @staticmethod
+    def _key(record: EmailRecord) -> str:
+        if record.message_id:
+            return record.message_id
+        return f'{record.from_email}|{record.date}|{record.subject}'
+
+    def add(self, mailbox: str, records: Iterable[EmailRecord]) -> None:
+        with self.lock:
+            for record in records:
+                key = self._key(record)
+                doc = self.keys.get(key)
+                if doc is not None:
+                    self.mailboxes[doc].add(mailbox)
+                    self.records.move_to_end(doc)
+                    continue
+
+                doc = self.next_doc
+                self.next_doc += 1
+                terms = Counter(tokenize(record.from_email))
+                terms.update(tokenize(record.body))
+                for token in tokenize(record.subject):
+                    terms[token] += self.subject_boost
+                for token, frequency in terms.items():
+                    self.postings[token][doc] = frequency
+
+                length = sum(terms.values())
+                self.keys[key] = doc
+                self.records[doc] = record
+                self.tokens[doc] = tuple(terms)
+                self.lengths[doc] = length
+                self.mailboxes[doc] = {mailbox}
+                self.total_length += length
+                if self.capacity and len(self.records) > self.capacity:
+                    self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        doc, record = self.records.popitem(last=False)
+        for token in self.tokens.pop(doc):
+            postings = self.postings[token]
+            del postings[doc]
+            if not postings:
+                del self.postings[token]
+        self.total_length -= self.lengths.pop(doc)
+        del self.mailboxes[doc]
+        del self.keys[self._key(record)]
+
+    def search(
+        self,
+        query: str,
+        mailbox: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        senders: Optional[List[str]] = None,
+        subjects: Optional[List[str]] = None,
+    ) -> List[EmailRecord]:
+        """
+        Rank the indexed emails matching any token of the query.
+
+        Filters follow the IMAP semantics used by `define_criteria`: dates are
+        compared by day (SINCE start, BEFORE end), senders are substrings of
+        the From header and subjects are substrings of the Subject.
+
+        Returns:
+            List[EmailRecord]: Matching emails, best match first.
+        """
+        tokens = set(tokenize(query))
+        with self.lock:
+            if not tokens or not self.records:
+                return []
+            total_docs = len(self.records)
+            average_length = self.total_length / total_docs
+            scores: Dict[int, float] = defaultdict(float)
+            for token in tokens:
+                postings = self.postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) /
+                               (len(postings) + 0.5))
+                for doc, frequency in postings.items():
+                    norm = self.k1 * \
+                        (1 - self.b + self.b * self.lengths[doc] / average_length)
+                    scores[doc] += idf * frequency * \
+                        (self.k1 + 1) / (frequency + norm)
+
+            matches = self._filter(
+                mailbox, start_date, end_date, senders, subjects)
+            ranked = sorted(
+                (doc for doc in scores if matches(doc)), key=lambda doc: scores[doc], reverse=True)
+            return [self.records[doc] for doc in ranked]
+
+    def records_matching(
+        self,
+        mailbox: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        senders: Optional[List[str]] = None,
+        subjects: Optional[List[str]] = None,
+    ) -> List[EmailRecord]:
+        """Every indexed email matching the filters of `search`, without a text query."""
+        with self.lock:
+            matches = self._filter(
+                mailbox, start_date, end_date, senders, subjects)
+            return [record for doc, record in self.records.items() if matches(doc)]
+
+    def _filter(
+        self,
+        mailbox: Optional[str],
+        start_date: Optional[datetime],
+        end_date: Optional[datetime],
+        senders: Optional[List[str]],
+        subjects: Optional[List[str]],
+    ) -> Callable[[int], bool]:
+        senders = [sender.casefold() for sender in senders or []]
+        subjects = [subject.casefold() for subject in subjects or []]
+        start = start_date.date() if start_date else None
+        end = end_date.date() if end_date else None
+
+        def matches(doc: int) -> bool:
+            record = self.records[doc]
+            if mailbox and mailbox not in self.mailboxes[doc]:
+                return False
+            if start or end:
+                if record.date is None:
+                    return False
+                day = record.date.date()
+                if (start and day < start) or (end and day >= end):
+                    return False
+            if senders:
+                from_email = (record.from_email or '').casefold()
+                if not any(sender in from_email for sender in senders):
+                    return False
+            if subjects:
+                subject = (record.subject or '').casefold()
+                if not any(text in subject for text in subjects):
+                    return False
+            return True
+
+        return matches
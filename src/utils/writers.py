@@ -0,0 +1,106 @@
+import gzip
+import json
+import mailbox
+from abc import ABC, abstractmethod
+from email.message import Message
+from pathlib import Path
+from typing import List, Tuple
+
+from ..models import EmailMessageModel, ExportFormat
+
+ExportItem = Tuple[bytes, Message, EmailMessageModel]
+
+
+class ExportWriter(ABC):
+    """
+    Appends batches of fetched emails to an export file.
+
+    Writers always append so a resumed job keeps what was already written.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    @abstractmethod
+    def write_batch(self, items: List[ExportItem]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JsonlWriter(ExportWriter):
+    def write_batch(self, items: List[ExportItem]) -> None:
+        # Every batch is its own gzip member, readers see one continuous stream
+        with gzip.open(self.path, 'ab') as file:
+            for uid, _, model in items:
+                line = json.dumps(
+                    {'uid': int(uid), **model.model_dump(mode='json')}, ensure_ascii=False)
+                file.write(line.encode('utf-8') + b'\n')
+
+
+class MboxWriter(ExportWriter):
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.mbox = mailbox.mbox(path)
+
+    def write_batch(self, items: List[ExportItem]) -> None:
+        self.mbox.lock()
+        try:
+            for _, msg, _ in items:
+                self.mbox.add(msg)
+            self.mbox.flush()
+        finally:
+            self.mbox.unlock()
+
+    def close(self) -> None:
+        self.mbox.close()
+
+
+class ParquetWriter(ExportWriter):
+    """Writes one parquet part file per batch inside the `path` directory."""
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ValueError(
+                'pyarrow must be installed to export to parquet') from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def write_batch(self, items: List[ExportItem]) -> None:
+        if not items:
+            return
+        rows = [{'uid': int(uid), **model.model_dump()}
+                for uid, _, model in items]
+        table = self.pa.Table.from_pylist(rows)
+        self.pq.write_table(
+            table, self.path / f'part-{int(items[0][0]):012d}.parquet', compression='zstd')
+
+
+def get_writer(export_format: ExportFormat, path: Path) -> ExportWriter:
+    writers = {
+        ExportFormat.JSONL: JsonlWriter,
+        ExportFormat.MBOX: MboxWriter,
+        ExportFormat.PARQUET: ParquetWriter,
+    }
+    return writers[export_format](path)
+
+
+def get_output_path(export_dir: Path, job_id: str, export_format: ExportFormat) -> Path:
+    extensions = {
+        ExportFormat.JSONL: '.jsonl.gz',
+        ExportFormat.MBOX: '.mbox',
+        ExportFormat.PARQUET: '',
+    }
+    return export_dir / f'{job_id}{extensions[export_format]}'
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import re
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional
+
+from .config import RELATIVE_DATE_PATTERN, WarmupQuery, config
+from .models import CursorModel
+from .service import EmailService
+from .utils.admission import AdmissionController
+
+
+def resolve_relative_date(expression: str, now: datetime) -> datetime:
+    """
+    Resolve a relative date of a `WarmupQuery` to midnight of that day.
+
+    Args:
+        expression (str): e.g. `today`, `month_start`, `today-7d` or `+1d`.
+        now (datetime): Reference time.
+    """
+    match = re.match(RELATIVE_DATE_PATTERN, expression)
+    if match is None:
+        raise ValueError(f'Invalid relative date {expression}')
+    base, offset = match.groups()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if base == 'tomorrow':
+        day = today + timedelta(days=1)
+    elif base == 'month_start':
+        day = today.replace(day=1)
+    elif base == 'next_month_start':
+        day = (today.replace(day=28) + timedelta(days=4)).replace(day=1)
+    else:
+        day = today
+    if offset:
+        day += timedelta(days=int(offset[:-1]))
+    return day
+
+
+class WarmupScheduler:
+    """
+    Re-runs the most common queries so their ids and first pages stay cached.
+
+    Queries run on startup and then every `interval` seconds. Warm-up never
+    competes with users: it waits until no live request is in flight, uses a
+    single IMAP connection and sleeps `delay` seconds between pages. With
+    `admission` every page takes a token of the account rate limit.
+    """
+
+    def __init__(
+        self,
+        service: EmailService,
+        queries: List[WarmupQuery],
+        interval: float,
+        pages: int,
+        page_size: int,
+        delay: float,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.service = service
+        self.queries = queries
+        self.interval = interval
+        self.pages = pages
+        self.page_size = page_size
+        self.delay = delay
+        self.admission = admission
+        self.live_requests = 0
+        self.task: Optional[asyncio.Task] = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @contextmanager
+    def live_request(self) -> Iterator[None]:
+        self.live_requests += 1
+        try:
+            yield
+        finally:
+            self.live_requests -= 1
+
+    async def _wait_until_idle(self) -> None:
+        while self.live_requests:
+            await asyncio.sleep(0.1)
+
+    async def run_once(self) -> None:
+        now = datetime.now()
+        for query in self.queries:
+            start_date = resolve_relative_date(query.start, now)
+            end_date = resolve_relative_date(query.end, now)
+            for page in range(1, self.pages + 1):
+                if self.admission is not None:
+                    await self.admission.take_token(self.service.email_user)
+                # Waiting for a token can take long, users may have arrived meanwhile
+                await self._wait_until_idle()
+                response = await asyncio.to_thread(
+                    self.service.get_paginated,
+                    start_date=start_date,
+                    end_date=end_date,
+                    cursor=CursorModel(page=page, page_size=self.page_size),
+                    senders=query.senders,
+                    subjects=query.subjects,
+                    mailbox=query.mailbox,
+                    refresh=True,
+                    max_connections=1
+                )
+                self.logger.info(
+                    f'[WARMUP] {query.mailbox} {start_date:%Y-%m-%d}..{end_date:%Y-%m-%d} page {page}: {response.meta.message}')
+                await asyncio.sleep(self.delay)
+                pagination = response.data.pagination if response.data else None
+                if pagination is None or page >= pagination.total_pages:
+                    break
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.logger.exception(f'[WARMUP] Failed: {e}')
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if not self.queries:
+            return
+        pages = len(self.queries) * self.pages
+        if pages > config.CACHE_CAPACITY_EMAIL_MODEL_LIST or len(self.queries) > config.CACHE_CAPACITY_EMAIL_ID_LIST:
+            self.logger.warning(
+                f'[WARMUP] Caches are too small to keep {len(self.queries)} queries and {pages} pages warm')
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
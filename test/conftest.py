@@ -0,0 +1,84 @@
+import socketserver
+import threading
+import time
+from datetime import datetime
+from email.message import EmailMessage
+from typing import Callable, Optional
+
+import pytest
+
+from src.models import EmailRecord
+
+SENDER = 'Banco <notificaciones@banco.com>'
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true',
+                     help='run the timing benchmarks')
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'benchmark: timing benchmark, only runs with --benchmark')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark'):
+        return
+    skip = pytest.mark.skip(reason='timing benchmark, run with --benchmark')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
+def build_email(subject: str, to: str = 'demo@gmail.com', body: Optional[str] = None,
+                message_id: Optional[str] = None) -> EmailMessage:
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = SENDER
+    msg['To'] = to
+    msg['Date'] = 'Fri, 05 Jul 2024 19:52:00 -0600'
+    if message_id is not None:
+        msg['Message-ID'] = message_id
+    msg.set_content(f'{subject} body' if body is None else body)
+    return msg
+
+
+def build_record(index: int, subject: Optional[str] = None,
+                 body: str = 'Comprobante de transacción\n' * 20, sender: str = SENDER) -> EmailRecord:
+    return EmailRecord(
+        subject=f'Notificación {index}' if subject is None else subject,
+        from_email=sender,
+        to_emails=('demo@gmail.com',),
+        date=datetime(2024, 7, 1 + index % 28, 12),
+        body=body,
+        message_id=f'<{index}@banco.com>'
+    )
+
+
+def measure(func: Callable, rounds: int = 1) -> float:
+    """Returns the best wall-clock time of `rounds` calls to `func`, in seconds."""
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@pytest.fixture
+def tcp_server():
+    """Starts ThreadingTCPServers for fake protocol handlers, shut down after the test."""
+    servers = []
+
+    def start(handler: type[socketserver.BaseRequestHandler]) -> socketserver.ThreadingTCPServer:
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
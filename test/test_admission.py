@@ -0,0 +1,224 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+from src.config import WarmupQuery
+from src.export import ExportManager
+from src.models import (ApiResponse, ExportRequest, ImapServer, Meta,
+                        OverloadedException, RateLimitedException)
+from src.utils.admission import AdmissionController, TokenBucket
+from src.warmup import WarmupScheduler
+
+
+def build_controller(**kwargs) -> AdmissionController:
+    options = dict(max_concurrent=1, max_queue=4, rate=1.0,
+                   burst=10, max_wait=5.0)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def test_bucket_waits_once_the_burst_is_spent():
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+
+
+def test_fresh_requests_over_the_rate_are_rejected():
+    controller = build_controller(rate=0.1, burst=1, max_wait=1.0)
+
+    async def run():
+        async with controller.admit('demo@gmail.com', cached=False):
+            pass
+        with pytest.raises(RateLimitedException) as error:
+            async with controller.admit('demo@gmail.com', cached=False):
+                pass
+        assert error.value.retry_after > 1.0
+        # Cached requests and other accounts do not spend this bucket
+        async with controller.admit('demo@gmail.com', cached=True):
+            pass
+        async with controller.admit('other@gmail.com', cached=False):
+            pass
+
+    asyncio.run(run())
+
+
+def test_full_queue_is_overloaded():
+    controller = build_controller(max_queue=1)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit('demo@gmail.com', cached=True):
+                await release.wait()
+
+        running = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(OverloadedException):
+            async with controller.admit('demo@gmail.com', cached=True):
+                pass
+        release.set()
+        await asyncio.gather(running, queued)
+        assert controller.running == 0
+
+    asyncio.run(run())
+
+
+def test_rejected_requests_give_their_token_back():
+    controller = build_controller(max_queue=0, rate=0.01, burst=2)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit('demo@gmail.com', cached=True):
+                await release.wait()
+
+        running = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        for _ in range(3):
+            with pytest.raises(OverloadedException):
+                async with controller.admit('demo@gmail.com', cached=False):
+                    pass
+        assert controller.buckets['demo@gmail.com'].tokens == 2
+        release.set()
+        await running
+
+    asyncio.run(run())
+
+
+def test_cached_requests_are_served_first():
+    controller = build_controller()
+
+    async def run():
+        order = []
+        release = asyncio.Event()
+
+        async def request(name: str, cached: bool):
+            async with controller.admit('demo@gmail.com', cached=cached):
+                order.append(name)
+                if name == 'running':
+                    await release.wait()
+
+        tasks = [asyncio.create_task(request('running', True))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request('fresh', False)))
+        tasks.append(asyncio.create_task(request('cached', True)))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ['running', 'cached', 'fresh']
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    controller = build_controller()
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit('demo@gmail.com', cached=True):
+                await release.wait()
+
+        running = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert not controller.waiters
+        release.set()
+        await running
+        assert controller.running == 0
+
+    asyncio.run(run())
+
+
+def test_background_jobs_wait_for_tokens_instead_of_failing():
+    controller = build_controller(rate=20.0, burst=1, max_wait=0.0)
+
+    async def run():
+        start = time.monotonic()
+        await controller.take_token('demo@gmail.com')
+        await controller.take_token('demo@gmail.com')
+        waited = time.monotonic() - start
+        # The background job spent the burst, live requests are limited too
+        with pytest.raises(RateLimitedException):
+            async with controller.admit('demo@gmail.com', cached=False):
+                pass
+        return waited
+
+    assert asyncio.run(run()) >= 0.04
+
+
+def test_invalid_stats_requests_do_not_spend_tokens(monkeypatch):
+    controller = build_controller(rate=0.01, burst=1, max_wait=0.0)
+    monkeypatch.setattr(main, 'admission_controller', controller)
+    client = TestClient(main.app)
+    params = {'start_date': '2024-07-01', 'end_date': '2024-07-31'}
+
+    for _ in range(2):
+        response = client.get(
+            '/inbox/stats', params={**params, 'group_by': 'subject'})
+        assert response.status_code == 406
+    assert not controller.buckets
+
+
+def test_exports_and_warmup_take_tokens(tmp_path):
+    taken = []
+    events = []
+
+    class RecordingController(AdmissionController):
+        async def take_token(self, account, max_wait=None):
+            taken.append(account)
+            events.append('token')
+
+    controller = RecordingController(1, 1, 1.0, 1, 1.0)
+
+    class FakeClient:
+        uid_validity = 1
+
+        def connect(self):
+            events.append('connect')
+
+        def disconnect(self):
+            pass
+
+        def fetch_email_uids(self, criteria):
+            return [b'1', b'2', b'3'], 0.0
+
+        def fetch_emails_by_uids(self, uids):
+            return []
+
+    manager = ExportManager('tokens@gmail.com', 'secret', ImapServer.GOOGLE,
+                            tmp_path, batch_size=2, admission=controller)
+    manager._get_client = lambda mailbox: FakeClient()
+
+    class FakeService:
+        email_user = 'tokens@gmail.com'
+
+        def get_paginated(self, **kwargs):
+            return ApiResponse(meta=Meta(status=200))
+
+    scheduler = WarmupScheduler(FakeService(), [WarmupQuery()], interval=60,
+                                pages=1, page_size=15, delay=0, admission=controller)
+
+    async def run():
+        job = manager.start(ExportRequest(
+            mailbox='inbox', start_date='2024-07-01', end_date='2024-07-31'))
+        await manager.tasks[job.id]
+        await scheduler.run_once()
+
+    asyncio.run(run())
+    # Export search, two export batches and one warm-up page
+    assert taken == ['tokens@gmail.com'] * 4
+    # The export waits for its token before taking a connection slot
+    assert events[:2] == ['token', 'connect']
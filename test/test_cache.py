@@ -0,0 +1,163 @@
+import pickle
+import socketserver
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from src.config import config
+from src.models import CACHE_SCHEMA_VERSION, ImapServer
+from src.service import EmailService
+from src.utils.cache import (CacheBackend, LRUCache, NearCache, RedisCache,
+                             create_cache, deserialize, serialize)
+
+from .conftest import build_record
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Speaks the subset of RESP used by RedisCache."""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        store = self.server.store
+        while (args := self.read_command()) is not None:
+            command = args[0].upper()
+            self.server.commands.append(command)
+            if command == b'GET':
+                value = store.get(args[1])
+                self.wfile.write(b'$-1\r\n' if value is None else
+                                 b'$%d\r\n%s\r\n' % (len(value), value))
+            elif command == b'SET':
+                store[args[1]] = args[2]
+                self.server.options[args[1]] = args[3:]
+                self.wfile.write(b'+OK\r\n')
+            elif command == b'DEL':
+                self.wfile.write(b':%d\r\n' % int(
+                    store.pop(args[1], None) is not None))
+            else:
+                self.wfile.write(b'-ERR unknown command\r\n')
+
+
+@pytest.fixture
+def redis_url(tcp_server):
+    server = tcp_server(FakeRedisHandler)
+    server.store = {}
+    server.commands = []
+    server.options = {}
+    return f'redis://127.0.0.1:{server.server_address[1]}/0', server
+
+
+def build_records(size: int):
+    return [build_record(index) for index in range(size)]
+
+
+def test_serialization_roundtrip_is_compact():
+    records = build_records(50)
+    data = serialize(records)
+    assert deserialize(data) == records
+    assert len(data) < len(repr(records)) / 5
+    assert deserialize(serialize([b'1', b'2'])) == [b'1', b'2']
+
+
+def test_serialization_keeps_record_types():
+    record = build_record(1)._replace(
+        date=datetime(2024, 7, 5, 19, 52, tzinfo=timezone.utc))
+    loaded = deserialize(serialize(record))
+    assert loaded == record
+    assert isinstance(loaded.to_emails, tuple)
+    assert loaded.date.tzinfo == timezone.utc
+    assert deserialize(serialize(record._replace(date=None))).date is None
+
+
+def test_pickled_entries_are_never_loaded():
+    class Exploit:
+        def __reduce__(self):
+            return (exec, ('raise SystemExit',))
+
+    with pytest.raises(ValueError):
+        deserialize(b'\x00' + pickle.dumps(Exploit()))
+
+
+def test_cache_backends_implement_the_interface():
+    with pytest.raises(TypeError):
+        CacheBackend()
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache[str](capacity=2, ttl=0.05)
+    cache.put('a', 'value')
+    assert cache.get('a') == 'value'
+    time.sleep(0.06)
+    assert cache.get('a') is None
+
+
+def test_redis_cache_is_shared_between_instances(redis_url):
+    url, server = redis_url
+    first = RedisCache(url, namespace='emails')
+    second = RedisCache(url, namespace='emails')
+    records = build_records(3)
+    first.put('page', records)
+    assert second.get('page') == records
+    second.delete('page')
+    assert first.get('page') is None
+
+
+def test_near_cache_serves_hot_keys_locally(redis_url):
+    url, server = redis_url
+    cache = create_cache('ids', capacity=5, backend='redis',
+                         url=url, near_ttl=60)
+    assert isinstance(cache, NearCache)
+    cache.put('ids', [b'1', b'2'])
+    server.commands.clear()
+    for _ in range(10):
+        assert cache.get('ids') == [b'1', b'2']
+    assert server.commands == []
+
+    other_worker = create_cache('ids', capacity=5, backend='redis', url=url)
+    assert other_worker.get('ids') == [b'1', b'2']
+    assert server.commands == [b'GET']
+
+
+def test_redis_cache_down_behaves_like_a_miss():
+    cache = RedisCache('redis://127.0.0.1:1/0', namespace='emails')
+    cache.put('key', 'value')
+    assert cache.get('key') is None
+
+
+@pytest.mark.parametrize('data', [
+    b'\x01not zlib data',
+    b'\x00' + b'csrc.models\nRemovedRecord\n.',
+])
+def test_unreadable_entries_are_a_miss_and_dropped(redis_url, data):
+    url, server = redis_url
+    cache = RedisCache(url, namespace='emails')
+    server.store[b'emails:page'] = data
+    assert cache.get('page') is None
+    assert b'emails:page' not in server.store
+    cache.put('page', ['fresh'])
+    assert cache.get('page') == ['fresh']
+
+
+def test_service_caches_are_versioned_and_expire(redis_url, monkeypatch):
+    url, server = redis_url
+    monkeypatch.setattr(config, 'CACHE_BACKEND', 'redis')
+    monkeypatch.setattr(config, 'CACHE_URL', url)
+    service = EmailService('ttl@gmail.com', 'secret', ImapServer.GOOGLE)
+    service.ids_cache.put('query', [b'1'])
+    service.message_cache.put('1000', 'record')
+
+    ids_key = f'email_reader:v{CACHE_SCHEMA_VERSION}:ttl@gmail.com:ids:query'.encode()
+    messages_key = f'email_reader:v{CACHE_SCHEMA_VERSION}:ttl@gmail.com:messages:1000'.encode()
+    assert server.options[ids_key] == [
+        b'PX', str(int(config.CACHE_QUERY_TTL_SECONDS * 1000)).encode()]
+    assert server.options[messages_key] == [
+        b'PX', str(int(config.CACHE_TTL_SECONDS * 1000)).encode()]
@@ -0,0 +1,171 @@
+import threading
+import uuid
+from imaplib import IMAP4
+
+import pytest
+
+from src import service as service_module
+from src.client import EmailClient
+from src.config import config
+from src.models import ImapServer, ThrottledException
+from src.service import EmailService
+from src.utils.concurrency import AIMDController, account_connection_slots
+
+
+def test_aimd_increases_additively_per_round():
+    controller = AIMDController(maximum=4)
+    controller.on_success(latency=0.1)
+    assert controller.limit == 2
+    controller.on_success(latency=0.1)
+    controller.on_success(latency=0.1)
+    assert controller.limit == 3
+    for _ in range(10):
+        controller.on_success(latency=0.1)
+    assert controller.limit == 4
+
+
+def test_aimd_holds_on_slow_responses_and_halves_on_throttle():
+    controller = AIMDController(maximum=8, initial=8, target_latency=1.0)
+    controller.on_success(latency=2.0)
+    assert controller.limit == 8
+    controller.on_throttle()
+    assert controller.limit == 4
+    for _ in range(5):
+        controller.on_throttle()
+    assert controller.limit == 1
+
+
+def test_connection_slots_are_shared_per_account():
+    slots = account_connection_slots('shared@gmail.com', 2)
+    assert account_connection_slots('shared@gmail.com', 5) is slots
+    assert account_connection_slots('other@gmail.com', 2) is not slots
+
+
+class FailingConnection:
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def fetch(self, message_set, items):
+        raise self.error
+
+
+@pytest.mark.parametrize('error, throttled', [
+    (IMAP4.abort('socket error: EOF'), True),
+    (ConnectionResetError('Connection reset by peer'), True),
+    (IMAP4.error('FETCH command error: BAD [THROTTLED] Too many requests'), True),
+    (IMAP4.error('FETCH command error: BAD Invalid message set'), False),
+])
+def test_fetch_errors_are_throttled_or_logged(error, throttled):
+    client = EmailClient('demo@gmail.com', 'secret', 'imap.gmail.com')
+    client.connection = FailingConnection(error)
+    if throttled:
+        with pytest.raises(ThrottledException):
+            client.fetch_email_map(['1', '2'])
+    else:
+        emails, _ = client.fetch_email_map(['1', '2'])
+        assert emails == {}
+
+
+class FakeFetchClient:
+    """Answers fetch_email_map with placeholder messages, throttling while `throttles` is positive."""
+
+    def __init__(self, server: 'FakeServer'):
+        self.server = server
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def fetch_email_map(self, email_ids):
+        with self.server.lock:
+            self.server.chunks.append(list(email_ids))
+            if self.server.throttles:
+                self.server.throttles -= 1
+                raise ThrottledException('[THROTTLED] Too many requests')
+        # Answer in reverse order and skip deleted ids, the service must restore the order
+        return {email_id: f'message-{email_id}' for email_id in reversed(email_ids)
+                if email_id not in self.server.deleted}, 0.1
+
+
+class FakeServer:
+    def __init__(self, throttles: int = 0, deleted=()):
+        self.throttles = throttles
+        self.deleted = set(deleted)
+        self.chunks = []
+        self.lock = threading.Lock()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(config, 'PARALLEL_FETCH_MIN_CHUNK', 2)
+    monkeypatch.setattr(config, 'IMAP_THROTTLE_RETRIES', 2)
+    sleeps = []
+    monkeypatch.setattr(service_module.time, 'sleep', sleeps.append)
+    service = EmailService(f'fetch-{uuid.uuid4().hex}@gmail.com',
+                           'secret', ImapServer.GOOGLE)
+    service.concurrency = AIMDController(maximum=4, initial=4)
+    service.sleeps = sleeps
+    return service
+
+
+def use_server(service: EmailService, server: FakeServer) -> None:
+    service._get_client = lambda mailbox=None: FakeFetchClient(server)
+
+
+EMAIL_IDS = [str(email_id) for email_id in range(1, 11)]
+
+
+def test_fetch_splits_chunks_and_keeps_the_order(service):
+    server = FakeServer(deleted={'4'})
+    use_server(service, server)
+    emails, _ = service._fetch_emails(EMAIL_IDS, 'inbox')
+
+    assert [email_id for email_id, _ in emails] == [
+        email_id for email_id in EMAIL_IDS if email_id != '4']
+    assert all(msg == f'message-{email_id}' for email_id, msg in emails)
+    assert sorted(map(len, server.chunks)) == [1, 3, 3, 3]
+    assert not service.sleeps
+
+
+def test_throttled_chunk_is_put_back_and_retried(service):
+    server = FakeServer(throttles=1)
+    use_server(service, server)
+    emails, _ = service._fetch_emails(EMAIL_IDS, 'inbox')
+
+    assert [email_id for email_id, _ in emails] == EMAIL_IDS
+    assert service.concurrency.limit < 4
+    # The throttled chunk is fetched again, nothing else is fetched twice
+    fetched = [email_id for chunk in server.chunks for email_id in chunk]
+    assert len(fetched) - len(EMAIL_IDS) == len(server.chunks[0])
+
+
+def test_fetch_gives_up_after_the_retries(service):
+    server = FakeServer(throttles=100)
+    use_server(service, server)
+    with pytest.raises(ThrottledException):
+        service._fetch_emails(EMAIL_IDS, 'inbox')
+    assert service.sleeps == [1, 2]
+    assert service.concurrency.limit == 1
+
+
+def test_busy_connection_slots_are_throttled(service, monkeypatch):
+    monkeypatch.setattr(config, 'IMAP_CONNECTION_WAIT_SECONDS', 0.01)
+    use_server(service, FakeServer())
+    service.connection_slots = threading.BoundedSemaphore(1)
+    service.connection_slots.acquire()
+    with pytest.raises(ThrottledException, match='busy'):
+        service._fetch_emails(EMAIL_IDS, 'inbox')
+    # Local contention is not server throttling
+    assert not service.sleeps
+    assert service.concurrency.limit == 4
+
+
+def test_workers_without_a_slot_leave_chunks_to_the_others(service, monkeypatch):
+    monkeypatch.setattr(config, 'IMAP_CONNECTION_WAIT_SECONDS', 0.01)
+    server = FakeServer()
+    use_server(service, server)
+    service.connection_slots = threading.BoundedSemaphore(2)
+    emails, _ = service._fetch_emails(EMAIL_IDS, 'inbox')
+    assert [email_id for email_id, _ in emails] == EMAIL_IDS
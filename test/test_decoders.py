@@ -1,5 +1,13 @@
+import html
+from email.header import decode_header, make_header
+
+import pytest
+
+from src.utils.headers import decode_header_value, decode_headers
 from src.utils.parser import decode_base64, decode_match, decode_quoted_printable, decode
 
+from .conftest import measure
+
 
 def test_decode_base64():
     encoded_str = "Q29tcHJvYmFudGUgZGUgdHJhbnNhY2Npw7Nu"
@@ -41,3 +49,65 @@ def test_decode_match_base64():
     expected = "Comprobante de transacción"
     assert decode_match(
         "=?UTF-8?B?Q29tcHJvYmFudGUgZGUgdHJhbnNhY2Npw7Nu?=") == expected
+
+
+def test_decode_match_uses_charset():
+    assert decode_match("=?ISO-8859-1?Q?caf=E9?=") == "café"
+    assert decode_match("=?windows-1252?B?Y2Fm6Q==?=") == "café"
+
+
+def test_decode_multiple_encoded_words():
+    # Whitespace between encoded-words is dropped, a character split across words is joined
+    subject = "=?UTF-8?B?Tm90aWZpY2FjacOz?= =?UTF-8?B?biBkZSB0cmFuc2FjY2k=?=\r\n =?UTF-8?B?w7Nu?="
+    assert decode(subject) == "Notificación de transacción"
+    assert decode("=?UTF-8?B?w7M=?=") == "ó"
+    assert decode("=?UTF-8?B?w6E?=") == "á"
+
+
+def test_decode_mixed_charsets_and_plain_text():
+    header = "Banco =?iso-8859-1?q?Caf=E9?= <=?koi8-r?b?8NLJ18XU?=@banco.com>"
+    assert decode(header) == "Banco Café <Привет@banco.com>"
+
+
+def test_decode_unknown_charset_falls_back_to_utf8():
+    assert decode("=?x-unknown?Q?Notificaci=C3=B3n?=") == "Notificación"
+
+
+def test_decode_plain_header_unfolds_and_unescapes():
+    assert decode("Pagos &amp; transferencias\r\n del mes") == "Pagos & transferencias del mes"
+    assert decode(None) is None
+
+
+def test_decode_headers_batch():
+    headers = ["=?UTF-8?Q?Notificaci=C3=B3n?=", "plain", None,
+               "=?UTF-8?Q?Notificaci=C3=B3n?="]
+    assert decode_headers(headers) == [
+        "Notificación", "plain", None, "Notificación"]
+
+
+@pytest.mark.benchmark
+def test_header_decoding_throughput():
+    headers = [
+        f"=?UTF-8?Q?Notificaci=C3=B3n_de_transacci=C3=B3n?= MXM S PABLO NORTE {i}" for i in range(500)
+    ] + [
+        f"=?UTF-8?B?Q29tcHJvYmFudGUgZGUgdHJhbnNhY2Npw7Nu?= {i}" for i in range(500)
+    ] + [
+        f"Banco <notificaciones{i % 10}@banco.com>" for i in range(2000)
+    ]
+
+    def legacy(values):
+        return [html.unescape(str(make_header(decode_header(value)))) for value in values]
+
+    def one_by_one(values):
+        return [decode_header_value(value) for value in values]
+
+    assert legacy(headers) == one_by_one(headers) == decode_headers(headers)
+
+    timings = {'legacy': measure(lambda: legacy(headers))}
+    decode_header_value.cache_clear()
+    timings['cold'] = measure(lambda: one_by_one(headers))
+    timings['warm'] = measure(lambda: one_by_one(headers))
+    decode_header_value.cache_clear()
+    timings['batch'] = measure(lambda: decode_headers(headers))
+    print('\nheaders/s: ' + ' '.join(
+        f'{name}={len(headers) / elapsed:,.0f}' for name, elapsed in timings.items()))
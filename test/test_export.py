@@ -0,0 +1,271 @@
+import asyncio
+import gzip
+import json
+import mailbox
+import sys
+import time
+from datetime import datetime
+from email.message import EmailMessage
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+from src.models import (ExportFormat, ExportRequest, ExportStatus, ImapServer,
+                        ThrottledException)
+from src.export import ExportManager
+
+from . import conftest
+
+UIDS = [b'101', b'102', b'103', b'104', b'105']
+
+
+def build_email(uid: bytes) -> EmailMessage:
+    return conftest.build_email(f'Transacción {uid.decode()}', body=f'Comprobante {uid.decode()}',
+                                message_id=f'<{uid.decode()}@banco.com>')
+
+
+class FakeExportClient:
+    """Serves `UIDS` and throttles the first fetch of a batch containing a uid of `failures`."""
+
+    uid_validity = 1
+
+    def __init__(self, failures: set):
+        self.failures = failures
+        self.fetched = []
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def fetch_email_uids(self, criteria):
+        return list(reversed(UIDS)), 0.0
+
+    def fetch_emails_by_uids(self, uids):
+        failed = self.failures.intersection(uids)
+        if failed:
+            self.failures.difference_update(failed)
+            raise ThrottledException('[THROTTLED] Too many requests')
+        self.fetched.extend(uids)
+        # Later batches answer first, the writer must still get them in order
+        time.sleep(0.01 * (len(UIDS) - UIDS.index(uids[0])))
+        return [(uid, build_email(uid)) for uid in uids]
+
+
+def build_manager(tmp_path, failures: set, account: str = 'demo@gmail.com', **kwargs) -> ExportManager:
+    manager = ExportManager(
+        account, 'secret', ImapServer.GOOGLE, tmp_path, batch_size=2, queue_size=1, **kwargs)
+    manager.clients = []
+
+    def get_client(mailbox):
+        manager.clients.append(FakeExportClient(failures))
+        return manager.clients[-1]
+
+    manager._get_client = get_client
+    return manager
+
+
+def build_request(export_format: ExportFormat) -> ExportRequest:
+    return ExportRequest(mailbox='inbox', start_date=datetime(2024, 7, 1),
+                         end_date=datetime(2024, 7, 31), format=export_format)
+
+
+def jsonl_uids(path) -> list:
+    if not path.exists():
+        return []
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        return [json.loads(line)['uid'] for line in file]
+
+
+def mbox_uids(path) -> list:
+    box = mailbox.mbox(path)
+    try:
+        return [int(msg['Message-ID'].strip('<>').split('@')[0]) for msg in box]
+    finally:
+        box.close()
+
+
+@pytest.mark.parametrize('export_format, read_uids', [
+    (ExportFormat.JSONL, jsonl_uids),
+    (ExportFormat.MBOX, mbox_uids),
+])
+def test_resume_after_failed_batch(tmp_path, export_format, read_uids):
+    manager = build_manager(tmp_path, failures={b'103'})
+
+    async def run():
+        job = manager.start(build_request(export_format))
+        await manager.tasks[job.id]
+        failed = manager.get(job.id).model_copy()
+        written = read_uids(Path(job.output_path))
+
+        manager.resume(job.id)
+        await manager.tasks[job.id]
+        return failed, written, manager.get(job.id)
+
+    failed, written, job = asyncio.run(run())
+
+    assert failed.status == ExportStatus.FAILED
+    assert 'THROTTLED' in failed.error
+    # Everything written before the failure is checkpointed, nothing after it
+    assert written == [int(uid) for uid in UIDS if int(uid) <= failed.last_uid]
+    assert failed.last_uid < 103
+    assert failed.exported_items == len(written)
+
+    assert job.status == ExportStatus.COMPLETED
+    assert job.error is None
+    assert job.last_uid == 105
+    assert job.exported_items == job.total_items == 5
+    assert read_uids(Path(job.output_path)) == [
+        101, 102, 103, 104, 105]
+
+
+def test_checkpoint_survives_a_restart(tmp_path):
+    manager = build_manager(tmp_path, failures={b'105'})
+
+    async def run():
+        job = manager.start(build_request(ExportFormat.JSONL))
+        await manager.tasks[job.id]
+        return job
+
+    failed = asyncio.run(run())
+    restarted = build_manager(tmp_path, failures=set())
+    job = restarted.get(failed.id)
+    assert job.status == ExportStatus.FAILED
+    assert job.last_uid == failed.last_uid
+    assert jsonl_uids(Path(job.output_path)) == [
+        int(uid) for uid in UIDS if int(uid) <= job.last_uid]
+
+    async def resume():
+        restarted.resume(job.id)
+        await restarted.tasks[job.id]
+
+    asyncio.run(resume())
+    assert jsonl_uids(Path(job.output_path)) == [101, 102, 103, 104, 105]
+
+
+def test_resume_fails_when_uid_validity_changes(tmp_path, monkeypatch):
+    manager = build_manager(tmp_path, failures=set())
+
+    async def run():
+        job = manager.start(build_request(ExportFormat.JSONL))
+        await manager.tasks[job.id]
+        # Interrupted after its last checkpoint
+        job.status = ExportStatus.FAILED
+        manager._save(job)
+        failed = job.model_copy()
+        written = jsonl_uids(Path(job.output_path))
+
+        monkeypatch.setattr(FakeExportClient, 'uid_validity', 2)
+        manager.resume(job.id)
+        await manager.tasks[job.id]
+        return failed, written, manager.get(job.id)
+
+    failed, written, job = asyncio.run(run())
+    assert failed.uid_validity == 1
+    assert job.status == ExportStatus.FAILED
+    assert 'UIDVALIDITY' in job.error
+    assert job.last_uid == failed.last_uid
+    assert jsonl_uids(Path(job.output_path)) == written
+
+
+def test_batches_are_fetched_over_several_connections(tmp_path):
+    manager = build_manager(tmp_path, failures=set(),
+                            account='parallel@gmail.com', connections=3)
+
+    async def run():
+        job = manager.start(build_request(ExportFormat.JSONL))
+        await manager.tasks[job.id]
+        return manager.get(job.id)
+
+    job = asyncio.run(run())
+    assert job.status == ExportStatus.COMPLETED
+    assert jsonl_uids(Path(job.output_path)) == [101, 102, 103, 104, 105]
+    assert len(manager.clients) == 3
+    assert all(client.fetched for client in manager.clients[1:])
+    # Every slot is given back
+    assert manager.connection_slots.acquire(blocking=False)
+    manager.connection_slots.release()
+
+
+def test_export_fails_when_every_connection_is_busy(tmp_path):
+    manager = build_manager(tmp_path, failures=set(), account='busy@gmail.com',
+                            max_connections=1, connection_wait=0.01)
+    manager.connection_slots.acquire()
+
+    async def run():
+        job = manager.start(build_request(ExportFormat.JSONL))
+        await manager.tasks[job.id]
+        return manager.get(job.id)
+
+    try:
+        job = asyncio.run(run())
+    finally:
+        manager.connection_slots.release()
+    assert job.status == ExportStatus.FAILED
+    assert 'busy' in job.error
+    assert not manager.clients
+
+
+def test_parquet_without_pyarrow_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    manager = build_manager(tmp_path, failures=set())
+    with pytest.raises(ValueError, match='pyarrow'):
+        manager.start(build_request(ExportFormat.PARQUET))
+    assert not manager.jobs
+
+
+def test_export_endpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'export_manager',
+                        build_manager(tmp_path, failures=set()))
+    body = {'mailbox': 'inbox', 'start_date': '2024-07-01',
+            'end_date': '2024-07-31', 'format': 'jsonl'}
+
+    with TestClient(main.app) as client:
+        response = client.post('/exports', json=body)
+        assert response.status_code == 202
+        job_id = response.json()['data']['id']
+
+        deadline = time.monotonic() + 5
+        while True:
+            response = client.get(f'/exports/{job_id}')
+            assert response.status_code == 200
+            job = response.json()['data']
+            if job['status'] == 'completed' or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+
+        assert job['status'] == 'completed'
+        assert job['exported_items'] == 5
+        assert job['last_uid'] == 105
+
+        assert client.get('/exports/missing').status_code == 404
+        assert client.post('/exports/missing/resume').status_code == 404
+
+        monkeypatch.setitem(sys.modules, 'pyarrow', None)
+        response = client.post('/exports', json={**body, 'format': 'parquet'})
+        assert response.status_code == 406
+        assert 'pyarrow' in response.json()['meta']['message']
+
+
+def test_export_skips_invalid_recipients(tmp_path, monkeypatch):
+    build_valid_email = build_email
+
+    def build_cron_email(uid: bytes) -> EmailMessage:
+        msg = build_valid_email(uid)
+        msg.replace_header('To', 'root@localhost')
+        return msg
+
+    monkeypatch.setattr(sys.modules[__name__], 'build_email', build_cron_email)
+    manager = build_manager(tmp_path, failures=set())
+
+    async def run():
+        job = manager.start(build_request(ExportFormat.JSONL))
+        await manager.tasks[job.id]
+        return manager.get(job.id)
+
+    job = asyncio.run(run())
+    assert job.status == ExportStatus.COMPLETED
+    assert jsonl_uids(Path(job.output_path)) == [101, 102, 103, 104, 105]
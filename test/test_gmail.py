@@ -0,0 +1,212 @@
+import socketserver
+from collections import Counter
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+from src.client import EmailClient
+from src.models import CursorModel, ImapServer
+from src.service import EmailService
+from src.utils.cache import LRUCache
+from src.utils.imap_search_criteria import define_gmail_criteria
+
+from .conftest import build_email
+
+
+def expand_message_set(ids: str):
+    for part in ids.split(','):
+        start, _, end = part.partition(':')
+        yield from range(int(start), int(end or start) + 1)
+
+
+class FakeGmailHandler(socketserver.StreamRequestHandler):
+    """Speaks the subset of IMAP used by EmailClient, plus X-GM-EXT-1."""
+
+    def send(self, line: str) -> None:
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        mailbox = []
+        self.send(f'* OK [CAPABILITY {self.server.capabilities}] Fake Gmail ready')
+        while line := self.rfile.readline():
+            tag, command, *rest = line.decode().rstrip('\r\n').split(' ', 2)
+            command = command.upper()
+            args = rest[0] if rest else ''
+            if command == 'CAPABILITY':
+                self.send(f'* CAPABILITY {self.server.capabilities}')
+            elif command == 'LOGIN':
+                self.server.logins += 1
+            elif command == 'SELECT':
+                mailbox = self.server.mailboxes[args.strip('"')]
+                self.send(f'* {len(mailbox)} EXISTS')
+            elif command == 'SEARCH':
+                self.server.searches.append(args)
+                ids = ' '.join(str(i) for i in range(1, len(mailbox) + 1))
+                self.send(f'* SEARCH {ids}')
+            elif command == 'FETCH':
+                ids, items = args.split(' ', 1)
+                for email_id in expand_message_set(ids):
+                    message_id, raw = mailbox[email_id - 1]
+                    if 'INTERNALDATE' in items:
+                        header = b'From: Banco <notificaciones@banco.com>\r\n\r\n'
+                        self.wfile.write(
+                            f'* {email_id} FETCH (INTERNALDATE "05-Jul-2024 19:52:00 -0600" '
+                            f'BODY[HEADER.FIELDS (FROM)] {{{len(header)}}}\r\n'.encode() + header + b')\r\n')
+                    elif 'RFC822' in items:
+                        self.server.downloads[message_id] += 1
+                        self.wfile.write(
+                            f'* {email_id} FETCH (RFC822 {{{len(raw)}}}\r\n'.encode() + raw + b')\r\n')
+                    else:
+                        self.send(
+                            f'* {email_id} FETCH (X-GM-MSGID {message_id})')
+            elif command == 'LOGOUT':
+                self.send('* BYE Logging out')
+                self.send(f'{tag} OK LOGOUT completed')
+                return
+            self.send(f'{tag} OK {command} completed')
+
+
+@pytest.fixture
+def gmail_server(tcp_server):
+    server = tcp_server(FakeGmailHandler)
+    messages = [
+        (str(1000 + i), build_email(
+            f'transaccion-{i}', message_id=f'<transaccion-{i}@banco.com>').as_bytes())
+        for i in range(4)
+    ]
+    server.mailboxes = {
+        'inbox': messages[:2],
+        '[Gmail]/All Mail': messages,
+    }
+    server.searches = []
+    server.downloads = Counter()
+    server.logins = 0
+    server.capabilities = 'IMAP4rev1 X-GM-EXT-1'
+    return server
+
+
+def test_gmail_criteria_flattens_or_trees():
+    criteria = define_gmail_criteria(
+        datetime(2024, 1, 1), datetime(2024, 1, 31),
+        senders=['a@bank.com', 'b@bank.com'], subjects=['Pago recibido'])
+    assert criteria.build() == (
+        'X-GM-RAW "after:2024/01/01 before:2024/01/31 '
+        '{from:a@bank.com from:b@bank.com}" SUBJECT "Pago recibido"')
+
+
+def test_gmail_criteria_keeps_substring_matches():
+    # Gmail's subject: and from: match whole words, IMAP SUBJECT and FROM match substrings
+    criteria = define_gmail_criteria(
+        datetime(2024, 1, 1), datetime(2024, 1, 31),
+        senders=['banco', 'b@bank.com'], subjects=['transacc', 'pago'])
+    assert criteria.build() == (
+        'X-GM-RAW "after:2024/01/01 before:2024/01/31" '
+        '(OR FROM "banco" FROM "b@bank.com") (OR SUBJECT "transacc" SUBJECT "pago")')
+
+
+def test_gmail_criteria_falls_back_for_non_ascii():
+    criteria = define_gmail_criteria(
+        datetime(2024, 1, 1), datetime(2024, 1, 31), subjects=['Notificación'])
+    assert 'X-GM-RAW' not in criteria.build()
+    assert 'SUBJECT' in criteria.build()
+
+
+def test_client_reads_gmail_message_ids(gmail_server):
+    port = gmail_server.server_address[1]
+    with EmailClient('demo@gmail.com', 'secret', '127.0.0.1', mailbox='[Gmail]/All Mail', port=port, use_ssl=False) as client:
+        assert client.supports_gmail_extensions
+        message_ids, _ = client.fetch_gmail_message_ids([b'1', b'3'])
+    assert message_ids == {'1': '1000', '3': '1002'}
+
+
+def test_client_reads_headers_without_bodies(gmail_server):
+    port = gmail_server.server_address[1]
+    with EmailClient('demo@gmail.com', 'secret', '127.0.0.1', mailbox='[Gmail]/All Mail', port=port, use_ssl=False) as client:
+        headers, _ = client.fetch_email_headers([b'1', b'2', b'3'])
+    assert len(headers) == 3
+    date, sender = headers[0]
+    assert (date.year, date.month, date.day, date.hour) == (2024, 7, 5, 19)
+    assert sender == 'Banco <notificaciones@banco.com>'
+    assert not gmail_server.downloads
+
+
+def build_gmail_service(server) -> EmailService:
+    port = server.server_address[1]
+    service = EmailService('demo@gmail.com', 'secret', ImapServer.GOOGLE)
+    service.gmail_extensions = True
+    service._get_client = lambda mailbox=None: EmailClient(
+        'demo@gmail.com', 'secret', '127.0.0.1', mailbox=mailbox or service.mailbox, port=port, use_ssl=False)
+    return service
+
+
+def read_page(service: EmailService, mailbox: str):
+    return service.get_paginated(
+        start_date=datetime(2024, 7, 1),
+        end_date=datetime(2024, 7, 31),
+        cursor=CursorModel(page=1, page_size=10),
+        mailbox=mailbox
+    )
+
+
+@pytest.mark.parametrize('capabilities', ['IMAP4rev1 X-GM-EXT-1', 'IMAP4rev1'])
+def test_fresh_page_logs_in_once_to_search_and_once_to_fetch(gmail_server, capabilities):
+    gmail_server.capabilities = capabilities
+    service = build_gmail_service(gmail_server)
+
+    page = read_page(service, 'inbox')
+    assert [item.subject for item in page.data.items] == [
+        'transaccion-0', 'transaccion-1']
+    assert gmail_server.logins == 2
+
+    # Cached ids and emails, the X-GM-MSGID lookup finds them by message
+    service.email_cache = LRUCache(capacity=1)
+    read_page(service, 'inbox')
+    assert gmail_server.logins == 3
+
+
+def test_message_fetched_in_inbox_is_a_hit_in_all_mail(gmail_server):
+    service = build_gmail_service(gmail_server)
+
+    def read(mailbox: str):
+        service.mailbox = mailbox
+        return service.get_paginated(
+            start_date=datetime(2024, 7, 1),
+            end_date=datetime(2024, 7, 31),
+            cursor=CursorModel(page=1, page_size=10),
+            senders=['notificaciones@banco.com', 'alertas@banco.com']
+        )
+
+    inbox = read('inbox')
+    all_mail = read('[Gmail]/All Mail')
+
+    assert len(inbox.data.items) == 2
+    assert [item.subject for item in all_mail.data.items] == [
+        f'transaccion-{i}' for i in range(4)]
+    assert all(search.startswith('X-GM-RAW')
+               for search in gmail_server.searches)
+    assert set(gmail_server.downloads.values()) == {1}
+
+
+@pytest.mark.parametrize('path', ['/[Gmail]/All Mail', '/%5BGmail%5D%2FAll%20Mail'])
+def test_labels_with_slashes_are_routed(gmail_server, monkeypatch, path):
+    port = gmail_server.server_address[1]
+    service = EmailService('demo@gmail.com', 'secret', ImapServer.GOOGLE)
+    service.gmail_extensions = True
+    service._get_client = lambda mailbox=None: EmailClient(
+        'demo@gmail.com', 'secret', '127.0.0.1', mailbox=mailbox, port=port, use_ssl=False)
+    monkeypatch.setattr(main, 'email_service', service)
+    params = {'start_date': '2024-07-01', 'end_date': '2024-07-31'}
+    client = TestClient(main.app)
+
+    inbox = client.get('/inbox', params=params)
+    all_mail = client.get(path, params=params)
+    stats = client.get(f'{path}/stats', params={**params, 'group_by': 'sender'})
+
+    assert inbox.status_code == all_mail.status_code == stats.status_code == 200
+    assert [item['subject'] for item in all_mail.json()['data']['items']] == [
+        f'transaccion-{i}' for i in range(4)]
+    assert stats.json()['data']['total_items'] == 4
+    # Emails fetched through the inbox are cache hits in All Mail
+    assert set(gmail_server.downloads.values()) == {1}
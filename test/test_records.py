@@ -0,0 +1,65 @@
+import email
+import tracemalloc
+from email.message import EmailMessage
+
+import pytest
+
+from src.models import EmailMessageModel
+from src.utils.parser import parse_email_message, parse_email_record
+
+from .conftest import build_email, measure
+
+
+def build_raw_email(index: int) -> bytes:
+    return build_email(f'Notificación de transacción {index}',
+                       to='Demo <demo@gmail.com>, other@gmail.com',
+                       body='Comprobante de transacción\n' * 20).as_bytes()
+
+
+def retained_size(factory) -> int:
+    tracemalloc.start()
+    value = factory()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del value
+    return size
+
+
+def test_record_to_model_matches_parsed_model():
+    msg = email.message_from_bytes(build_raw_email(1))
+    record = parse_email_record(msg)
+    assert record.to_emails == ('demo@gmail.com', 'other@gmail.com')
+    assert record.to_model() == parse_email_message(msg)
+    assert isinstance(record.to_model(validate=True), EmailMessageModel)
+
+
+def test_invalid_recipients_are_dropped_before_caching():
+    msg = EmailMessage()
+    msg['Subject'] = 'Cron <root@server> backup'
+    msg['From'] = 'root@localhost'
+    msg['To'] = 'root@localhost, Demo <Demo@GMAIL.com>'
+    msg.set_content('done')
+    record = parse_email_record(msg)
+    assert record.to_emails == ('Demo@gmail.com',)
+    # Cached records skip validation, they must be what validation would produce
+    assert record.to_model(validate=True) == record.to_model()
+
+
+def test_records_are_cheaper_than_cached_messages():
+    raw_emails = [build_raw_email(index) for index in range(200)]
+    messages = [email.message_from_bytes(raw) for raw in raw_emails]
+
+    message_size = retained_size(
+        lambda: [email.message_from_bytes(raw) for raw in raw_emails])
+    record_size = retained_size(
+        lambda: [parse_email_record(msg) for msg in messages])
+    assert record_size < message_size
+
+
+@pytest.mark.benchmark
+def test_page_build_benchmark():
+    records = [parse_email_record(email.message_from_bytes(build_raw_email(index)))
+               for index in range(200)]
+    validated = measure(lambda: [record.to_model(validate=True) for record in records])
+    constructed = measure(lambda: [record.to_model() for record in records])
+    print(f'\npage build: validated={validated * 1000:.2f}ms constructed={constructed * 1000:.2f}ms')
@@ -0,0 +1,102 @@
+from datetime import datetime
+
+import pytest
+
+from src.utils.search_index import SearchIndex, tokenize
+
+from .conftest import build_record, measure
+
+
+def test_tokenize_strips_accents_and_case():
+    assert tokenize('Notificación de TRANSACCIÓN') == [
+        'notificacion', 'de', 'transaccion']
+
+
+def test_search_ranks_subject_matches_first():
+    index = SearchIndex()
+    index.add('inbox', [
+        build_record(0, 'Estado de cuenta', 'su comprobante de pago'),
+        build_record(1, 'Comprobante de pago', 'gracias por su compra'),
+        build_record(2, 'Promociones', 'nada que ver'),
+    ])
+    results = index.search('comprobante')
+    assert [record.message_id for record in results] == [
+        '<1@banco.com>', '<0@banco.com>']
+
+
+def test_search_filters_by_mailbox_dates_and_senders():
+    index = SearchIndex()
+    records = [
+        build_record(0, 'Pago', 'pago recibido'),
+        build_record(5, 'Pago', 'pago recibido', sender='tienda@shop.com'),
+        build_record(10, 'Pago', 'pago recibido'),
+    ]
+    index.add('inbox', records)
+    index.add('[Gmail]/All Mail', records[:1])
+
+    assert len(index) == 3
+    assert index.search('pago', mailbox='[Gmail]/All Mail') == records[:1]
+    assert index.search('pago', start_date=datetime(2024, 7, 2), end_date=datetime(
+        2024, 7, 11)) == [records[1]]
+    assert index.search('pago', senders=['banco.com'], start_date=datetime(
+        2024, 7, 2)) == [records[2]]
+
+
+@pytest.mark.benchmark
+def test_search_benchmark():
+    index = SearchIndex()
+    words = ['pago', 'compra', 'retiro', 'deposito', 'transferencia',
+             'tarjeta', 'cuenta', 'saldo', 'cajero', 'comercio']
+    index.add('inbox', [
+        build_record(i, f'Notificación de {words[i % 10]} {i}',
+                     ' '.join(words[(i + j) % 10] for j in range(40)))
+        for i in range(20000)
+    ])
+    elapsed = measure(lambda: index.search('transferencia cajero'), rounds=3)
+    print(f'\nsearch over {len(index)} emails: {elapsed * 1000:.1f}ms')
+
+
+def test_index_evicts_oldest_emails_over_capacity():
+    index = SearchIndex(capacity=2)
+    records = [build_record(i, f'Pago {i}', f'referencia{i}') for i in range(3)]
+    index.add('inbox', records[:2])
+    # Adding an email again keeps it, the other one becomes the oldest
+    index.add('[Gmail]/All Mail', records[:1])
+    index.add('inbox', records[2:])
+
+    assert len(index) == 2
+    assert index.search('referencia1') == []
+    assert 'referencia1' not in index.postings
+    assert set(index.search('pago')) == {records[0], records[2]}
+    assert index.total_length == sum(index.lengths.values())
+    index.add('inbox', records[1:2])
+    assert index.search('referencia1') == [records[1]]
+
+
+def test_search_filters_by_subject():
+    index = SearchIndex()
+    records = [
+        build_record(0, 'Notificación de transacción', 'pago recibido'),
+        build_record(1, 'Estado de cuenta', 'pago recibido'),
+    ]
+    index.add('inbox', records)
+    assert index.search('pago', subjects=['transacc']) == [records[0]]
+    assert index.records_matching(subjects=['CUENTA']) == [records[1]]
+
+
+def test_search_endpoint_applies_the_subject_filter(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from src import main
+
+    index = SearchIndex()
+    index.add('inbox', [
+        build_record(0, 'Notificación de transacción', 'pago recibido'),
+        build_record(1, 'Estado de cuenta', 'pago recibido'),
+    ])
+    monkeypatch.setattr(main.email_service, 'search_index', index)
+    response = TestClient(main.app).get('/inbox', params={
+        'start_date': '2024-07-01', 'end_date': '2024-08-01', 'q': 'pago', 'subject': 'cuenta'})
+    assert response.status_code == 200
+    assert [item['subject'] for item in response.json()['data']['items']] == [
+        'Estado de cuenta']
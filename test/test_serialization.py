@@ -0,0 +1,67 @@
+import json
+from datetime import datetime, timezone
+from http import HTTPStatus
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from src.models import (ApiResponse, EmailMessageModel, Meta,
+                        PaginatedResponse, PaginationMeta)
+from src.utils.responses import PydanticJSONResponse
+
+from .conftest import measure
+
+
+def build_response(size: int) -> ApiResponse[PaginatedResponse[EmailMessageModel]]:
+    items = [
+        EmailMessageModel(
+            subject=f"Notificación de transacción {index}",
+            from_email="Banco <notificaciones@banco.com>",
+            to_emails=["demo@gmail.com"],
+            date=datetime(2024, 7, 5, 19, 52, tzinfo=timezone.utc),
+            body="Comprobante de transacción\n" * 20
+        )
+        for index in range(size)
+    ]
+    return ApiResponse(
+        meta=Meta(status=HTTPStatus.OK, message="ok", request_time=0.1),
+        data=PaginatedResponse(
+            pagination=PaginationMeta(
+                total_items=size, total_pages=1, page_size=size, current_page=1),
+            items=items
+        )
+    )
+
+
+def legacy_render(response: ApiResponse) -> bytes:
+    content = jsonable_encoder(response.model_dump())
+    json.dumps(content)  # previously used to compute the Content-Length
+    return JSONResponse(status_code=response.meta.status, content=content).body
+
+
+def fast_render(response: ApiResponse) -> bytes:
+    return PydanticJSONResponse(status_code=response.meta.status, content=response).body
+
+
+def test_fast_render_matches_legacy():
+    response = build_response(3)
+    legacy = json.loads(legacy_render(response))
+    fast = json.loads(fast_render(response))
+    assert legacy == fast
+    assert fast['data']['items'][0]['date'] == '2024-07-05T19:52:00+00:00'
+
+
+def test_fast_render_sets_content_length():
+    response = PydanticJSONResponse(
+        status_code=HTTPStatus.OK, content=build_response(2))
+    assert response.headers['content-length'] == str(len(response.body))
+
+
+@pytest.mark.benchmark
+def test_serialization_benchmark():
+    response = build_response(1000)
+    legacy = measure(lambda: legacy_render(response), rounds=5)
+    fast = measure(lambda: fast_render(response), rounds=5)
+    print(
+        f"\nserialization per 1k messages: legacy={legacy * 1000:.2f}ms fast={fast * 1000:.2f}ms ({legacy / fast:.1f}x)")
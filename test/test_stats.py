@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.models import ImapServer
+from src.service import EmailService
+from src.utils.aggregation import count_by
+
+from .conftest import measure
+
+DATES = [datetime(2024, 7, 1, 9), datetime(2024, 7, 1, 18),
+         datetime(2024, 7, 2, 9), None]
+SENDERS = ['Banco <Alertas@banco.com>', 'alertas@banco.com',
+           'Tienda <ventas@shop.com>', None]
+
+
+def test_count_by_sender_and_day():
+    assert count_by(DATES, SENDERS, ['sender', 'day']) == [
+        ({'sender': 'alertas@banco.com', 'day': '2024-07-01'}, 2),
+        ({'sender': 'unknown', 'day': 'unknown'}, 1),
+        ({'sender': 'ventas@shop.com', 'day': '2024-07-02'}, 1),
+    ]
+
+
+def test_count_by_domain_and_month():
+    assert count_by(DATES, SENDERS, ['domain', 'month']) == [
+        ({'domain': 'banco.com', 'month': '2024-07'}, 2),
+        ({'domain': 'shop.com', 'month': '2024-07'}, 1),
+        ({'domain': 'unknown', 'month': 'unknown'}, 1),
+    ]
+
+
+def test_count_by_rejects_unknown_fields():
+    with pytest.raises(ValueError):
+        count_by(DATES, SENDERS, ['subject'])
+
+
+class EmptyMailboxClient:
+    def __init__(self, connections: list):
+        self.connections = connections
+
+    def __enter__(self):
+        self.connections.append(self)
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def fetch_email_ids(self, criteria):
+        return [], 0.0
+
+
+def test_stats_without_matches_only_connect_to_search():
+    connections = []
+    service = EmailService('stats@gmail.com', 'secret', ImapServer.GOOGLE)
+    service._get_client = lambda mailbox=None: EmptyMailboxClient(connections)
+
+    response = service.get_stats(
+        datetime(2024, 7, 1), datetime(2024, 7, 31), ['sender'])
+    assert response.data.total_items == 0
+    assert response.data.groups == []
+    assert len(connections) == 1
+
+
+@pytest.mark.benchmark
+def test_count_by_benchmark():
+    size = 50000
+    dates = [datetime(2024, 1, 1) + timedelta(hours=i) for i in range(size)]
+    senders = [f'Sender {i % 20} <sender{i % 20}@bank.com>' for i in range(size)]
+    elapsed = measure(lambda: count_by(dates, senders, ['sender', 'day']))
+    print(f'\ngrouping {size} emails: {elapsed * 1000:.1f}ms')
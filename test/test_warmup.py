@@ -0,0 +1,122 @@
+import asyncio
+from datetime import datetime
+
+import anyio
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+from src.config import WarmupQuery
+from src.models import ApiResponse, Meta, PaginatedResponse, PaginationMeta
+from src.utils.admission import AdmissionController
+from src.warmup import WarmupScheduler, resolve_relative_date
+
+NOW = datetime(2024, 12, 20, 15, 30)
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('today', datetime(2024, 12, 20)),
+    ('tomorrow', datetime(2024, 12, 21)),
+    ('today-7d', datetime(2024, 12, 13)),
+    ('-7d', datetime(2024, 12, 13)),
+    ('month_start', datetime(2024, 12, 1)),
+    ('next_month_start', datetime(2025, 1, 1)),
+    ('month_start+1d', datetime(2024, 12, 2)),
+])
+def test_resolve_relative_date(expression, expected):
+    assert resolve_relative_date(expression, NOW) == expected
+
+
+def test_resolve_relative_date_rejects_unknown_expressions():
+    with pytest.raises(ValueError):
+        resolve_relative_date('yesterday', NOW)
+
+
+class FakeService:
+    email_user = 'demo@gmail.com'
+
+    def __init__(self, total_pages: int):
+        self.total_pages = total_pages
+        self.calls = []
+
+    def get_paginated(self, **kwargs):
+        self.calls.append(kwargs)
+        return ApiResponse(
+            meta=Meta(status=200, message='ok'),
+            data=PaginatedResponse(pagination=PaginationMeta(
+                total_pages=self.total_pages), items=[])
+        )
+
+
+def build_scheduler(service: FakeService, pages: int) -> WarmupScheduler:
+    return WarmupScheduler(service=service, queries=[WarmupQuery(mailbox='[Gmail]/All Mail')],
+                           interval=60, pages=pages, page_size=15, delay=0)
+
+
+def test_warmup_stops_at_the_last_page():
+    service = FakeService(total_pages=2)
+    asyncio.run(build_scheduler(service, pages=5).run_once())
+
+    assert [call['cursor'].page for call in service.calls] == [1, 2]
+    assert all(call['refresh'] and call['max_connections'] == 1
+               and call['mailbox'] == '[Gmail]/All Mail' for call in service.calls)
+
+
+def test_warmup_waits_for_live_requests():
+    service = FakeService(total_pages=1)
+    scheduler = build_scheduler(service, pages=1)
+
+    async def run():
+        with scheduler.live_request():
+            task = asyncio.create_task(scheduler.run_once())
+            await asyncio.sleep(0.25)
+            assert not service.calls
+        await asyncio.wait_for(task, timeout=1)
+
+    asyncio.run(run())
+    assert len(service.calls) == 1
+
+
+def test_warmup_waits_for_requests_that_arrive_during_the_token_wait():
+    service = FakeService(total_pages=1)
+    scheduler = build_scheduler(service, pages=1)
+    token = asyncio.Event()
+
+    class SlowController(AdmissionController):
+        async def take_token(self, account, max_wait=None):
+            await token.wait()
+
+    scheduler.admission = SlowController(1, 1, 1.0, 1, 1.0)
+
+    async def run():
+        task = asyncio.create_task(scheduler.run_once())
+        await asyncio.sleep(0)
+        with scheduler.live_request():
+            token.set()
+            await asyncio.sleep(0.25)
+            assert not service.calls
+        await asyncio.wait_for(task, timeout=1)
+
+    asyncio.run(run())
+    assert len(service.calls) == 1
+
+
+def test_live_requests_are_visible_while_the_service_runs(monkeypatch):
+    seen = []
+
+    async def observe() -> int:
+        return main.warmup_scheduler.live_requests
+
+    def get_paginated(**kwargs):
+        # The event loop is free while the service runs, warm-up can see the request
+        seen.append(anyio.from_thread.run(observe))
+        return ApiResponse(meta=Meta(status=200, message='ok'))
+
+    monkeypatch.setattr(main.email_service, 'is_cached', lambda **kwargs: True)
+    monkeypatch.setattr(main.email_service, 'get_paginated', get_paginated)
+    response = TestClient(main.app).get(
+        '/inbox', params={'start_date': '2024-07-01', 'end_date': '2024-07-31'})
+
+    assert response.status_code == 200
+    assert seen == [1]
+    assert main.warmup_scheduler.live_requests == 0